@@ -4,9 +4,7 @@ import sys
 import logging
 import setproctitle
 import multiprocessing
-import psutil
 import time
-import re
 import traceback
 import argparse
 
@@ -29,6 +27,8 @@ DN = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(DN + '/src')
 from cloudinventario.cloudinventario import CloudInventario
 import cloudinventario.storage as storage
+from cloudinventario.deadline import hard_timeout
+from cloudinventario.buffer import BUFFER_MEMORY
 
 # Create APP
 app = Flask(__name__)
@@ -102,7 +102,7 @@ def collect():
         data = {         
           "config": collector_config,
           "name": col,
-          "options": {'tasks': int(CONFIG['process']['tasks']), 'check_permission': False}
+          "options": {'tasks': int(CONFIG['process']['tasks']), 'check_permission': False, 'stream': CONFIG['process']['stream'], 'timeout': CONFIG['process']['timeout'], 'buffer_memory': CONFIG['process']['buffer_memory']}
         }
 
         # Define id for task, add into result(ids), add id into TASKS
@@ -124,9 +124,23 @@ def collect():
 # --- HELPERS METHOD ---
 def do_metrics(future, metrics_dict):
   future_result = future.result()
-  metrics_dict['cloudinventario_cpu_usage'].labels(source=future_result[1]['name']).set(future_result[1]['cpu_usage'])
-  metrics_dict['cloudinventario_mem_usage'].labels(source=future_result[1]['name']).set(future_result[1]['mem_usage'])
-  metrics_dict['cloudinventario_runtime'].labels(source=future_result[1]['name']).set(future_result[1]['runtime'])
+  res = future_result[1]
+  metrics_dict['cloudinventario_cpu_usage'].labels(source=res['name']).set(res['cpu_usage'])
+  metrics_dict['cloudinventario_cpu_time'].labels(source=res['name']).set(res['cpu_time'])
+  metrics_dict['cloudinventario_mem_usage'].labels(source=res['name']).set(res['mem_usage'])
+  metrics_dict['cloudinventario_runtime'].labels(source=res['name']).set(res['runtime'])
+  for stage, usage in res['stages'].items():
+    metrics_dict['cloudinventario_stage_runtime'].labels(source=res['name'], stage=stage).set(usage['runtime'])
+    metrics_dict['cloudinventario_stage_cpu_time'].labels(source=res['name'], stage=stage).set(usage['cpu_time'])
+    metrics_dict['cloudinventario_stage_mem_usage'].labels(source=res['name'], stage=stage).set(usage['mem_peak'])
+  for api in res['api']:
+    labels = {'source': res['name'], 'service': api['service'], 'operation': api['operation']}
+    metrics_dict['cloudinventario_api_calls'].labels(**labels).set(api['count'])
+    metrics_dict['cloudinventario_api_errors'].labels(**labels).set(api['errors'])
+    metrics_dict['cloudinventario_api_throttled'].labels(**labels).set(api['throttled'])
+    metrics_dict['cloudinventario_api_time'].labels(**labels).set(api['time'])
+    for bound, count in api['buckets']:
+      metrics_dict['cloudinventario_api_latency_bucket'].labels(**labels, le='+Inf' if bound == float('inf') else str(bound)).set(count)
   if future_result[0] is True:
     metrics_dict['cloudinventario_success'].labels(source=future_result[1]['name']).inc()
   else:
@@ -155,52 +169,50 @@ def collect(data):
    cinv = CloudInventario(config)
 
    logging.info("collector name={}".format(name))
-   runtime_start = time.time()
    try:
     # # Check if testing login
     #  if args.test_login:
     #     return cinv.login(name, options)
-    
-     proc = psutil.Process()
-     proc.cpu_percent(0.1)
-     runtime_start = time.time()
-
-     inventory = cinv.collect(name, options)
-
-     runtime = time.time() - runtime_start
-     cpu_usage = proc.cpu_percent()
-     mem_usage = psutil.virtual_memory()[2]
-
-     if inventory is not None:
-        logging.info("storing data for name={}".format(name))
-        cinv.store(inventory, runtime)
-        logging.debug("collector name={} finished".format(name))
-        return True, {'name': name, 'runtime': runtime, 'cpu_usage': cpu_usage, 'mem_usage': mem_usage}
-     else:
-        cinv.store_status(name, storage.STATUS_FAIL, runtime)
-        logging.info("collector failed name={}".format(name))
-   except Exception as e:
-    # Not added to error previous -> # cpu_usage = psutil.cpu_percent(round(runtime))
-     proc_error = psutil.Process()
-     proc_error.cpu_percent(0.1)
-     cpu_usage = proc.cpu_percent() if proc else proc_error.cpu_percent()
 
-     runtime = time.time() - runtime_start
-     mem_usage = psutil.virtual_memory()[2]
+     # collection (and storing) is interrupted if cooperative cancellation does not work
+     with hard_timeout(cinv.collectorTimeout(name, options), "collector {}".format(name)):
+       inventory = cinv.collect(name, options)
+       runtime = cinv.getUsage(name)['runtime']
+
+       if inventory is not None:
+          logging.info("storing data for name={}".format(name))
+          cinv.store(inventory, runtime, name)
+          logging.debug("collector name={} finished".format(name))
+          return True, get_resource(cinv, name)
+       else:
+          cinv.store_status(name, storage.STATUS_FAIL, runtime)
+          logging.info("collector failed name={}".format(name))
+   except Exception as e:
+     res = get_resource(cinv, name)
+     runtime = res['runtime']
      trace = traceback.format_exc()
-     tb = str(traceback.format_exc()).split('\n')
-     for  index, line in enumerate(tb):
-        if 'in collect' in line:
-          stage = re.search(r'([a-z]*?)\.(.*)\(', tb[index+1])
-          stage = stage.group(2) if stage else None 
-          break
+     stage = cinv.getFailedStage(name, e)
 
      cinv.store_status(name, storage.STATUS_ERROR, runtime, trace)
      logging.error("collector name={} failed with exception".format(name), exc_info=e)
-     return False, {'name': name, 'runtime': runtime, 'cpu_usage': cpu_usage, 'mem_usage': mem_usage, 'stage': stage}
+     return False, {**res, 'stage': stage}
    finally:
      setproctitle.setproctitle(proctitle)
-   return False, {'name': name, 'runtime': runtime, 'cpu_usage': cpu_usage, 'mem_usage': mem_usage, 'stage': 'end'}
+   return False, {**get_resource(cinv, name), 'stage': 'end'}
+
+def get_resource(cinv, name):
+  # cpu_usage in %, mem_usage is peak RSS in bytes
+  usage = cinv.getUsage(name)
+  return {
+    'name': name,
+    'runtime': usage['runtime'],
+    'cpu_usage': usage['cpu_usage'],
+    'cpu_time': usage['cpu_time'],
+    'mem_usage': usage['mem_peak'],
+    'stages': usage['stages'],
+    'api': usage['api'],
+    'denied': usage['denied'],
+  }
 
 # --- CONFIGS ---
 # Create metrics for Prometheus
@@ -242,9 +254,54 @@ def prometheusConfig():
   )
   metrics_dict['cloudinventario_mem_usage'] = Gauge(
       'cloudinventario_mem_usage',
-      'How much CPU was used during collection Cloudinventario entry',
+      'Peak RSS (bytes) of the collector process during collection',
       ['source']
   )
+  metrics_dict['cloudinventario_cpu_time'] = Gauge(
+      'cloudinventario_cpu_time',
+      'CPU seconds used during collection Cloudinventario entry',
+      ['source']
+  )
+  metrics_dict['cloudinventario_stage_runtime'] = Gauge(
+      'cloudinventario_stage_runtime',
+      'Runtime of collection stage',
+      ['source', 'stage']
+  )
+  metrics_dict['cloudinventario_stage_cpu_time'] = Gauge(
+      'cloudinventario_stage_cpu_time',
+      'CPU seconds used during collection stage',
+      ['source', 'stage']
+  )
+  metrics_dict['cloudinventario_stage_mem_usage'] = Gauge(
+      'cloudinventario_stage_mem_usage',
+      'Peak RSS (bytes) during collection stage',
+      ['source', 'stage']
+  )
+  metrics_dict['cloudinventario_api_calls'] = Gauge(
+      'cloudinventario_api_calls',
+      'Number of API calls',
+      ['source', 'service', 'operation']
+  )
+  metrics_dict['cloudinventario_api_errors'] = Gauge(
+      'cloudinventario_api_errors',
+      'Number of failed API calls',
+      ['source', 'service', 'operation']
+  )
+  metrics_dict['cloudinventario_api_throttled'] = Gauge(
+      'cloudinventario_api_throttled',
+      'Number of throttled API calls',
+      ['source', 'service', 'operation']
+  )
+  metrics_dict['cloudinventario_api_time'] = Gauge(
+      'cloudinventario_api_time',
+      'Total time (seconds) spent in API calls',
+      ['source', 'service', 'operation']
+  )
+  metrics_dict['cloudinventario_api_latency_bucket'] = Gauge(
+      'cloudinventario_api_latency_bucket',
+      'Number of API calls with latency (seconds) less or equal to le',
+      ['source', 'service', 'operation', 'le']
+  )
   return metrics_dict
 
 # Load config and init for Sentry
@@ -287,11 +344,14 @@ def processesConfig():
   app.config['EXECUTOR_MAX_WORKERS'] = int(os.getenv('PROCESS_FORKS') or 1)
   logging.info(f"Config with EXECUTOR_MAX_WORKERS={os.getenv('PROCESS_FORKS') or 1}, PROCESS_TASKS={os.getenv('PROCESS_TASKS')}")
   return {
-    'storage': {'dsn': os.getenv('STORAGE_DSN')},
+    'storage': {'dsn': os.getenv('STORAGE_DSN'), 'pool_size': int(os.getenv('STORAGE_POOL_SIZE') or storage.POOL_SIZE)},
     'process': {
       'forks': int(os.getenv('PROCESS_FORKS') or 1),
       'tasks': int(os.getenv('PROCESS_TASKS') or 1),
-      'die_after_request': os.getenv('PROCESS_DIE_AFTER_REQUEST')
+      'die_after_request': os.getenv('PROCESS_DIE_AFTER_REQUEST'),
+      'stream': os.getenv('PROCESS_STREAM', '').lower() in ['1', 'true', 'yes'],
+      'timeout': int(os.getenv('PROCESS_TIMEOUT')) if os.getenv('PROCESS_TIMEOUT') else None,
+      'buffer_memory': float(os.getenv('PROCESS_BUFFER_MEMORY')) if os.getenv('PROCESS_BUFFER_MEMORY') else BUFFER_MEMORY
     },
     'endpoint_host': args.host if args.host else os.getenv('ENDPOINT_HOST'),
     'endpoint_port': args.port if args.port else os.getenv('ENDPOINT_PORT')
@@ -0,0 +1,87 @@
+"""Record buffer with bounded memory, records over the limit are spilled to a temporary file."""
+import os
+import pickle
+import tempfile
+import logging
+
+from cloudinventario.record import CloudRecord, get_record_schema
+
+# default memory limit (MB) of one buffer
+BUFFER_MEMORY = 256
+
+# rough per value overhead (bytes) used by size estimation
+VALUE_OVERHEAD = 16
+
+def record_size(rec):
+  # estimate, strings (JSON details, attributes, ...) dominate the size of records
+  values = rec.row if isinstance(rec, CloudRecord) else rec.values()
+  size = 0
+  for value in values:
+    size += VALUE_OVERHEAD
+    if isinstance(value, (str, bytes)):
+      size += len(value)
+  return size
+
+class CloudInventarioBuffer:
+  """List-like buffer of records (append, len, iterate, repeatedly).
+
+  Up to memory MB of records are kept in memory, then they are pickled in
+  batches to an anonymous temporary file and read back while iterating.
+  Memory None or 0 keeps all records in memory.
+  """
+
+  def __init__(self, memory = BUFFER_MEMORY):
+    self.limit = int(float(memory) * 1024 * 1024) if memory else None
+    self.records = []
+    self.size = 0
+    self.count = 0
+    self.file = None
+    self.batches = []   # (offset, length) of spilled batches
+
+  def __spill(self):
+    if self.file is None:
+      self.file = tempfile.TemporaryFile(prefix = "cloudinventario-")
+      logging.debug("spilling records to temporary file, limit={}MB".format(self.limit // (1024 * 1024)))
+    data = pickle.dumps([(rec.table, rec.row) if isinstance(rec, CloudRecord) else (None, rec)
+                           for rec in self.records], protocol = pickle.HIGHEST_PROTOCOL)
+    offset = self.file.seek(0, os.SEEK_END)
+    self.file.write(data)
+    self.file.flush()
+    self.batches.append((offset, len(data)))
+    self.records = []
+    self.size = 0
+
+  def append(self, rec):
+    self.records.append(rec)
+    self.count += 1
+    if self.limit:
+      self.size += record_size(rec)
+      if self.size >= self.limit:
+        self.__spill()
+
+  def extend(self, records):
+    for rec in records:
+      self.append(rec)
+
+  def __len__(self):
+    return self.count
+
+  def __iter__(self):
+    # pread() does not move file position, so iterations and appends do not interfere
+    for offset, length in list(self.batches):
+      for table, values in pickle.loads(os.pread(self.file.fileno(), length, offset)):
+        yield CloudRecord(get_record_schema(table), values) if table else values
+    yield from list(self.records)
+
+  @property
+  def spilled(self):
+    return self.count - len(self.records)
+
+  def close(self):
+    if self.file is not None:
+      self.file.close()
+      self.file = None
+    self.batches = []
+    self.records = []
+    self.size = 0
+    self.count = 0
@@ -0,0 +1,116 @@
+"""Checkpoints of partially finished collections (resume after failure)."""
+import os
+import re
+import json
+import stat
+import time
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+
+from cloudinventario.record import CloudRecord, get_record_schema
+
+# default staging area (private to user) and how long (seconds) finished units can be reused
+CHECKPOINT_DIR = os.path.join(tempfile.gettempdir(), "cloudinventario-checkpoint-{}".format(os.getuid()))
+CHECKPOINT_WINDOW = 3600
+
+MANIFEST = "manifest.json"
+
+class CloudInventarioCheckpoint:
+  """Records of finished units (e.g. account/region) of one source, kept until the collection finishes.
+
+  Config is True or dict with "path" and "window" (seconds).
+  """
+
+  def __init__(self, name, config = None):
+    config = config if isinstance(config, dict) else {}
+    self.window = config.get('window', CHECKPOINT_WINDOW)
+    self.base = config.get('path', CHECKPOINT_DIR)
+    self.path = os.path.join(self.base, re.sub(r'[^A-Za-z0-9_.@-]', '_', name))
+    self.lock = threading.Lock()
+    self.manifest = None
+
+  def __unit_file(self, unit):
+    return os.path.join(self.path, hashlib.sha1(unit.encode('utf-8')).hexdigest() + ".jsonl")
+
+  def __private_dir(self, path):
+    # staged records are trusted when read back, nobody else may write them
+    os.makedirs(path, mode = 0o700, exist_ok = True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+      raise PermissionError("checkpoint directory {} must be a directory private to the user".format(path))
+
+  def __encode(self, value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+      return {"__bytes__": base64.b64encode(bytes(value)).decode('ascii')}
+    return str(value)
+
+  def __decode(self, value):
+    if isinstance(value, dict) and "__bytes__" in value:
+      return base64.b64decode(value["__bytes__"])
+    return value
+
+  def __write_manifest(self):
+    fd, tmp = tempfile.mkstemp(dir = self.path, suffix = ".tmp")
+    with os.fdopen(fd, "w") as f:
+      json.dump(self.manifest, f)
+    os.replace(tmp, os.path.join(self.path, MANIFEST))
+
+  def begin(self, units):
+    # resume previous collection of the same units (if recent), otherwise start over
+    fingerprint = hashlib.sha1(json.dumps(sorted(units)).encode('utf-8')).hexdigest()
+    self.__private_dir(self.base)
+    self.__private_dir(self.path)
+    manifest = None
+    try:
+      with open(os.path.join(self.path, MANIFEST)) as f:
+        manifest = json.load(f)
+    except (OSError, ValueError):
+      pass
+
+    if manifest and manifest.get("fingerprint") == fingerprint and manifest.get("started", 0) + self.window > time.time():
+      self.manifest = manifest
+      logging.info("resuming collection path={}, finished units={}/{}".format(self.path, len(manifest["done"]), len(units)))
+    else:
+      self.clear()
+      self.manifest = {"fingerprint": fingerprint, "started": time.time(), "done": []}
+    self.__write_manifest()
+    return self.manifest["done"]
+
+  def is_done(self, unit):
+    return self.manifest is not None and unit in self.manifest["done"]
+
+  def save(self, unit, records):
+    # unit is finished, its records are stored before the unit is marked as done
+    # JSON lines of [table, values] (table None for dict records)
+    fd, tmp = tempfile.mkstemp(dir = self.path, suffix = ".tmp")
+    with os.fdopen(fd, "w") as f:
+      for rec in records:
+        if isinstance(rec, CloudRecord):
+          f.write(json.dumps([rec.table, rec.row], default = self.__encode))
+        else:
+          f.write(json.dumps([None, rec], default = self.__encode))
+        f.write("\n")
+    os.replace(tmp, self.__unit_file(unit))
+    with self.lock:
+      self.manifest["done"].append(unit)
+      self.__write_manifest()
+
+  def load(self, unit):
+    with open(self.__unit_file(unit)) as f:
+      for line in f:
+        table, values = json.loads(line, object_hook = self.__decode)
+        yield CloudRecord(get_record_schema(table), values) if table else values
+
+  def clear(self):
+    # whole collection finished
+    if not os.path.isdir(self.path):
+      return
+    for fname in os.listdir(self.path):
+      try:
+        os.unlink(os.path.join(self.path, fname))
+      except OSError:
+        pass
+    self.manifest = None
@@ -8,17 +8,24 @@ import time
 import logging
 from pprint import pprint
 import traceback
-import psutil
 
 from cloudinventario.storage import InventoryStorage
+from cloudinventario.usage import CloudInventarioUsage
+from cloudinventario.limiter import CloudInventarioLimiter
 
 COLLECTOR_PREFIX = 'cloudinventario'
+API_LOG_TOP = 10
 
 class CloudInventario:
 
     def __init__(self, config):
         self.config = config
         self.lock = threading.Lock()
+        self.usage = {}
+        # collectors with records not stored yet, see store()
+        self.instances = {}
+        # options of streamed collections with metrics not emitted yet
+        self.streaming = {}
 
     @property
     def collectors(self):
@@ -36,6 +43,10 @@ class CloudInventario:
     def collectorConfig(self, collector):
         return self.config['collectors'][collector]
 
+    def collectorTimeout(self, collector, options=None):
+        # seconds, collector config overrides global option
+        return self.collectorConfig(collector)['config'].get('timeout', (options or {}).get('timeout'))
+
     def loadCollector(self, collector, options=None):
         mod_cfg = self.collectorConfig(collector)
 
@@ -82,8 +93,9 @@ class CloudInventario:
             os.chdir(wd)
 
     def doMetric(self, options, metric_name, set=1, source=None, stage=None):
-        if 'metrics' in options:
-            metric =  options['metrics'][metric_name]
+        metrics = (options or {}).get('prometheus_metrics')
+        if metrics and metric_name in metrics:
+            metric = metrics[metric_name]
             if stage and source:
                 metric = metric.labels(stage=stage, source=source)
             elif source:
@@ -94,8 +106,35 @@ class CloudInventario:
             else:
                metric.set(set)
 
+    def getUsage(self, collector):
+        # runtime, cpu_time, cpu_usage (%), mem_peak (bytes) and the same per stage, api call statistics
+        if collector not in self.usage:
+            return {"runtime": 0, "cpu_time": 0, "cpu_usage": 0, "mem_peak": 0, "stages": {}, "failed_stage": None, "api": [], "denied": []}
+        return self.usage[collector].summary()
+
+    def getFailedStage(self, collector, error=None):
+        if collector not in self.usage:
+            return None
+        return self.usage[collector].get_failed_stage(error)
+
+    def usageMetrics(self, options, collector):
+        usage = self.getUsage(collector)
+        self.doMetric(options, 'cloudinventario_cpu_usage', source=collector, set=usage['cpu_usage'])
+        self.doMetric(options, 'cloudinventario_mem_usage', source=collector, set=usage['mem_peak'])
+        self.doMetric(options, 'cloudinventario_runtime', source=collector, set=usage['runtime'])
+        for stage, stage_usage in usage['stages'].items():
+            self.doMetric(options, 'cloudinventario_stage_runtime', source=collector, stage=stage, set=stage_usage['runtime'])
+        for denied in usage['denied']:
+            logging.warning("permission denied source={}, scope={}, resource={}, cached={}".format(
+                collector, denied['scope'], denied['resource'], denied['cached']))
+        # most expensive API calls of the run
+        for api in usage['api'][:API_LOG_TOP]:
+            logging.info("api call source={}, call={}.{}, count={}, time={:.3f}s, errors={}, throttled={}".format(
+                collector, api['service'], api['operation'], api['count'], api['time'], api['errors'], api['throttled']))
+        return usage
+
     def pushMetrics(self, options):
-        if 'prometheus_pushadd' in options:
+        if options and 'prometheus_pushadd' in options:
             options['prometheus_pushadd']()
 
     def collect(self, collector, options=None):
@@ -106,49 +145,106 @@ class CloudInventario:
 
         self.doMetric(options, 'cloudinventario_source')
         self.doMetric(options, 'cloudinventario_entries_collected', source=collector)
+        usage = self.usage[collector] = CloudInventarioUsage(reset_peak=True)
+        # inventory limits count records of this collection only
+        CloudInventarioLimiter().reset(collector, self.collectorConfig(collector)['config'])
+        streamed = False
         try:
-            runtime_start = time.time()
-            instance = self.loadCollector(collector, options)
+            with usage.stage('load'):
+              instance = self.loadCollector(collector, options)
+            # collector records its own stages (login, fetch, logout, ...)
+            instance.usage = usage
+            self.instances[collector] = instance
             instance.login()
-            inventory = instance.fetch()
-            instance.logout()
-            runtime = time.time() - runtime_start
+            if (options or {}).get('stream'):
+              # records are fetched while being stored, see InventoryStorage.save(),
+              # metrics are emitted when fetching (__stream()) and storing (store()) finished
+              inventory = self.__stream(collector, instance, options, wd)
+              if len(getattr(instance, 'status_error', [])) > 0:
+                inventory = {'data': inventory, 'errors': instance.status_error}
+              self.streaming[collector] = options
+              streamed = True
+            else:
+              inventory = instance.fetch()
+              instance.logout()
 
-            self.doMetric(options, 'cloudinventario_cpu_usage', source=collector, set=psutil.cpu_percent(round(runtime)))
-            self.doMetric(options, 'cloudinventario_mem_usage', source=collector, set=psutil.virtual_memory()[2])
-            self.doMetric(options, 'cloudinventario_runtime', source=collector, set=runtime)
-            self.doMetric(options, 'cloudinventario_success', source=collector)
+              self.usageMetrics(options, collector)
+              self.doMetric(options, 'cloudinventario_success', source=collector)
         except Exception as e:
-          # Find stage from trackback
-            runtime = time.time() - runtime_start
-            self.doMetric(options, 'cloudinventario_cpu_usage', source=collector, set=psutil.cpu_percent(round(runtime)))
-            self.doMetric(options, 'cloudinventario_mem_usage', source=collector, set=psutil.virtual_memory()[2])
-            self.doMetric(options, 'cloudinventario_runtime', source=collector, set=runtime)
-
-            tb = str(traceback.format_exc()).split('\n')
-            for  index, line in enumerate(tb):
-              if 'in collect' in line:
-                stage = re.search(r'instance\.(.*)\(', tb[index+1])
-                stage = stage.group(1) if stage else None 
-                break
-            self.doMetric(options, 'cloudinventario_error', source=collector, stage=stage)
-
-            logging.error("Exception while processing collector={}".format(collector)) 
+            self.instances.pop(collector, None)
+            self.__failed(options, collector, e)
             raise
         finally:
-            self.pushMetrics(options)
+            if not streamed:
+              self.pushMetrics(options)
             os.chdir(wd)
         return inventory
 
-    def store(self, inventory, runtime=None):
+    def __failed(self, options, collector, error, stage=None):
+        self.usageMetrics(options, collector)
+
+        stage = self.getFailedStage(collector, error) or stage
+        self.doMetric(options, 'cloudinventario_error', source=collector, stage=stage)
+
+        logging.error("Exception while processing collector={}".format(collector))
+
+    def __stream(self, collector, instance, options, wd):
+        # collector code runs in /tmp (see collect()), storage code in original directory
+        records = instance.fetch_stream()
+        try:
+            try:
+                while True:
+                    os.chdir("/tmp")
+                    try:
+                        rec = next(records)
+                    except StopIteration:
+                        break
+                    finally:
+                        os.chdir(wd)
+                    yield rec
+            finally:
+                records.close()
+                instance.logout()
+            self.usageMetrics(options, collector)
+        except Exception as e:
+            if self.streaming.pop(collector, None) is not None:
+                self.instances.pop(collector, None)
+                self.__failed(options, collector, e)
+                self.pushMetrics(options)
+            raise
+
+    def store(self, inventory, runtime=None, collector=None):
         store_config = self.config["storage"]
 
-        with self.lock:
-            store = InventoryStorage(store_config)
+        try:
+            with self.lock:
+                store = InventoryStorage(store_config)
 
-            store.connect()
-            store.save(inventory, runtime)
-            store.disconnect()
+                store.connect()
+                if collector in self.usage:
+                  with self.usage[collector].stage('store'):
+                    store.save(inventory, runtime)
+                else:
+                  store.save(inventory, runtime)
+                store.disconnect()
+        except Exception as e:
+            # streamed collection failed while storing (fetch failures are reported by __stream())
+            options = self.streaming.pop(collector, None)
+            if options is not None:
+                self.instances.pop(collector, None)
+                self.__failed(options, collector, e, stage='store')
+                self.pushMetrics(options)
+            raise
+
+        options = self.streaming.pop(collector, None)
+        if options is not None:
+            self.doMetric(options, 'cloudinventario_success', source=collector)
+            self.pushMetrics(options)
+
+        # records are committed, collector may drop its staged data (e.g. checkpoints)
+        instance = self.instances.pop(collector, None)
+        if instance is not None:
+            instance.stored()
 
         return True
 
@@ -0,0 +1,60 @@
+"""Wall-clock deadlines of collectors and resources."""
+import time
+import signal
+import threading
+import contextlib
+
+# seconds given to cooperative cancellation before hard_timeout() interrupts the process
+HARD_TIMEOUT_GRACE = 60
+
+class CloudInventarioTimeout(Exception):
+  pass
+
+class CloudDeadline:
+  """Deadline (timeout in seconds, None = no deadline), never later than its parent."""
+
+  def __init__(self, timeout = None, parent = None, name = None):
+    self.name = name
+    self.timeout = timeout
+    self.parent = parent
+    self.expires = (time.monotonic() + float(timeout)) if timeout else None
+    if parent is not None and parent.expires is not None:
+      if self.expires is None or parent.expires < self.expires:
+        self.expires = parent.expires
+        self.name = parent.name
+        self.timeout = parent.timeout
+
+  def remaining(self):
+    if self.expires is None:
+      return None
+    return max(0, self.expires - time.monotonic())
+
+  def expired(self):
+    return self.expires is not None and time.monotonic() >= self.expires
+
+  def check(self):
+    # call regularly from long running loops (cooperative cancellation)
+    if self.expired():
+      raise CloudInventarioTimeout("{} timed out after {}s".format(self.name or "collection", self.timeout))
+
+@contextlib.contextmanager
+def hard_timeout(timeout, name = None, grace = HARD_TIMEOUT_GRACE):
+  """Interrupt (SIGALRM) the main thread when timeout + grace expires.
+
+  Used by worker processes, not available in other threads (no-op).
+  """
+  if not timeout or threading.current_thread() is not threading.main_thread() or not hasattr(signal, 'setitimer'):
+    yield
+    return
+
+  seconds = float(timeout) + grace
+  def alarm(signum, frame):
+    raise CloudInventarioTimeout("{} timed out after {}s (hard)".format(name or "collection", seconds))
+
+  previous = signal.signal(signal.SIGALRM, alarm)
+  signal.setitimer(signal.ITIMER_REAL, seconds)
+  try:
+    yield
+  finally:
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    signal.signal(signal.SIGALRM, previous)
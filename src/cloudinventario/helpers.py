@@ -4,12 +4,29 @@ import datetime
 import json
 import logging
 import importlib
-import dns.resolver
-import dns.exception
+import concurrent.futures
+import functools
+import queue
+import threading
+import time
+import random
 from pprint import pprint
 
 import cloudinventario.platform as platform
-from cloudinventario.limiter import CloudInventarioLimiter
+from cloudinventario.limiter import CloudInventarioLimiter, CloudInventarioRateLimits
+from cloudinventario.resolver import CloudInventarioResolver
+from cloudinventario.record import get_record_schema
+from cloudinventario.usage import CloudInventarioUsage
+from cloudinventario.instrument import is_throttled
+from cloudinventario.refcache import get_reference_cache
+from cloudinventario.deadline import CloudDeadline
+from cloudinventario.buffer import CloudInventarioBuffer, BUFFER_MEMORY
+
+# records buffered between parallel resource fetches and the consumer
+RESOURCE_QUEUE_SIZE = 1000
+
+# seconds until resources denied by permissions are tried again
+PERMISSION_DENIED_TTL = 21600
 
 class CloudEncoder(json.JSONEncoder):
   def default(self, z):
@@ -18,6 +35,158 @@ class CloudEncoder(json.JSONEncoder):
     else:
       return super().default(z)
 
+class CloudSerializer:
+  """Serializer of JSON columns (networks, attributes, details, ...)."""
+  name = 'json'
+
+  def __init__(self):
+    # same output as json.dumps(obj, cls=CloudEncoder, default=str), without creating encoder on every call
+    self.encoder = json.JSONEncoder(default=str)
+
+  def dumps(self, obj):
+    return self.encoder.encode(obj)
+
+class CloudOrjsonSerializer(CloudSerializer):
+  """orjson based serializer, compact output (no spaces, UTF-8, NaN as null)."""
+  name = 'orjson'
+
+  def __init__(self):
+    import orjson
+    self.orjson = orjson
+    # datetime are passed to default=str as in CloudEncoder
+    self.option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+  def dumps(self, obj):
+    return self.orjson.dumps(obj, default=str, option=self.option).decode('utf-8')
+
+SERIALIZERS = {
+  'json': CloudSerializer,
+  'orjson': CloudOrjsonSerializer,
+}
+serializers = {}
+
+def get_serializer(name = None):
+  name = name or 'json'
+  if name not in serializers:
+    try:
+      serializers[name] = SERIALIZERS[name]()
+    except ImportError as e:
+      logging.warning("Serializer {} not available ({}), using json".format(name, e))
+      serializers[name] = get_serializer('json')
+  return serializers[name]
+
+class CloudProjection:
+  """Keep/drop/truncate rules for details and attributes, per inventory type.
+
+  Config (per collector, "*" applies to all inventory types):
+    projection:
+      "*":
+        details:
+          drop: [key, ...]        # remove keys
+      vm:
+        details:
+          keep: [key, ...]        # keep only these keys
+          truncate: {key: size}   # cut longer strings/lists
+        attributes:
+          drop: [key, ...]
+  """
+  COLUMNS = ['details', 'attributes']
+
+  def __init__(self, config):
+    self.config = config or {}
+    self.rules = {}
+
+  def get_rule(self, rectype, column):
+    key = (rectype, column)
+    if key not in self.rules:
+      self.rules[key] = self.__compile(rectype, column)
+    return self.rules[key]
+
+  def __compile(self, rectype, column):
+    keep = None
+    drop = set()
+    truncate = {}
+    for name in ["*", rectype]:
+      rule = (self.config.get(name) or {}).get(column) or {}
+      if rule.get('keep') is not None:
+        keep = set(rule['keep'])
+      drop.update(rule.get('drop') or [])
+      truncate.update(rule.get('truncate') or {})
+
+    if keep is None and len(drop) == 0 and len(truncate) == 0:
+      return None
+    return (keep, drop, truncate)
+
+  def apply(self, rectype, column, data):
+    rule = self.get_rule(rectype, column)
+    if rule is None or not isinstance(data, dict):
+      return data
+
+    keep, drop, truncate = rule
+    result = {}
+    for key, value in data.items():
+      if (keep is not None and key not in keep) or key in drop:
+        continue
+      size = truncate.get(key)
+      if size is not None and isinstance(value, (str, bytes, list, tuple)) and len(value) > size:
+        value = value[:size]
+      result[key] = value
+    return result
+
+class CloudRetry:
+  """Retry of throttled API calls with exponential backoff and (full) jitter.
+
+  Config keys: attempts, delay, max-delay, max-elapsed (seconds).
+  """
+
+  def __init__(self, config = None, retryable = is_throttled):
+    config = config or {}
+    self.attempts = config.get('attempts', 5)
+    self.delay = config.get('delay', 1)
+    self.max_delay = config.get('max-delay', 30)
+    self.max_elapsed = config.get('max-elapsed', 120)
+    self.retryable = retryable
+
+  def wait(self, error, attempt, start, limiter = None):
+    # sleep before next attempt, False if error should be raised
+    if attempt + 1 >= self.attempts or not self.retryable(error):
+      return False
+    delay = random.uniform(0, min(self.max_delay, self.delay * 2 ** attempt))
+    if time.time() - start + delay > self.max_elapsed:
+      return False
+    logging.warning("retrying throttled call in {:.1f}s (attempt {}/{}): {}".format(delay, attempt + 2, self.attempts, error))
+    if limiter is not None and limiter.rate > 0:
+      # all users of the shared bucket pause, not only this thread
+      limiter.pause(delay)
+      limiter.acquire(0)
+    else:
+      time.sleep(delay)
+    return True
+
+  def call(self, func, *args, **kwargs):
+    return self.call_limited(None, func, *args, **kwargs)
+
+  def call_limited(self, limiter, func, *args, **kwargs):
+    # token of rate limiter (CloudInventarioRateLimiter) is acquired before every attempt
+    attempt, start = 0, time.time()
+    while True:
+      try:
+        if limiter is not None:
+          limiter.acquire()
+        return func(*args, **kwargs)
+      except Exception as e:
+        if not self.wait(e, attempt, start, limiter):
+          raise
+      attempt += 1
+
+  def paginate(self, paginator, **kwargs):
+    # boto3 paginator, only the throttled page request is retried (the iterator keeps its position)
+    pages = paginator.paginate(**kwargs)
+    method = getattr(pages, '_method', None)
+    if method is not None:
+      pages._method = functools.partial(self.call, method)
+    return pages
+
 class CloudCollector:
   """Cloud collector."""
 
@@ -32,24 +201,46 @@ class CloudCollector:
 
     self.allow_self_signed = options.get('allow_self_signed', config.get('allow_self_signed', False))
     self.verify_ssl = self.options.get('verify_ssl_certs', config.get('verify_ssl_certs', True))
+    self.serializer = get_serializer(self.options.get('serializer', config.get('serializer')))
+    self.projection = CloudProjection(config.get('projection'))
+    self.retry = CloudRetry(self.options.get('retry', config.get('retry')))
+
+    # catalogs (instance types, ...) cached on disk, shared by all collectors
+    self.reference_cache = get_reference_cache(self.options.get('reference_cache', config.get('reference-cache')),
+                                               config.get('reference-cache-ttl'))
     requests.packages.urllib3.disable_warnings()
 
-    # TODO: separate this ?
-    self.resolver = dns.resolver.Resolver()
-    self.resolver.timeout = 1
-    self.resolver.lifetime = 1
-    self.resolver.use_search_by_default = False
+    # shared by all collectors (cache)
+    self.resolver = CloudInventarioResolver()
 
     self.resource_manager = None
     self.resource_collectors = {}
+
+    # stages (login, fetch, ...) with their runtime and failures, replaced by the one of
+    # CloudInventario.collect(), own usage of (child) collectors never resets peak RSS
+    self.usage = CloudInventarioUsage()
+
+    # wall-clock limit of whole collection (seconds), checked while fetching
+    self.deadline = CloudDeadline(config.get('timeout', self.options.get('timeout')), name = "collector {}".format(self.name))
+
+    # memory (MB) of fetched records, the rest is spilled to disk (see CloudInventarioBuffer)
+    self.buffer_memory = config.get('buffer-memory', self.options.get('buffer_memory', BUFFER_MEMORY))
+
+    # objects shared with child collectors (see share()), e.g. SDK model loaders
+    self.shared = {}
+    self.shared_lock = threading.Lock()
     return
 
   def _init(self, **kwargs):
     self.collector_pkg = kwargs['collector_pkg']
     self.resources = kwargs['resources']
-    self.dependencies = self._get_dependencies()
+    self.dependencies = self.get_dependencies()
 
     self.resource_collectors = self.load_resource_collectors(self.resources) or {}
+    for resource, names in (self._get_resource_indexes() or {}).items():
+      if resource in self.resource_collectors:
+        for name in names:
+          self.resource_collectors[resource].need_index(name)
     return True
 
   def __pre_request(self):
@@ -61,10 +252,12 @@ class CloudCollector:
   def login(self):
     self.__pre_request()
     try:
-      session = self._login()
-      if session is None or session is False:
-        raise Exception("Login failed")
-      self.resource_login(session)
+      with self.stage('login'):
+        session = self._login()
+        if session is None or session is False:
+          raise Exception("Login failed")
+      with self.stage('resource_login'):
+        self.resource_login(session)
       return 0
     except:
       logging.warning("Failed to login the following collector: {}".format(self.name))
@@ -85,45 +278,114 @@ class CloudCollector:
   def fetch(self, collect = None):
     self.__pre_request()
     try:
-      data = []
-      data.extend(self._resource_fetch())
-      data.extend(self._fetch(collect))
-
-      data = list(filter(lambda x: x, data))
+      with self.stage('fetch'):
+        data = CloudInventarioBuffer(self.buffer_memory)
+        data.extend(self.__fetch_records(collect))
+      if data.spilled:
+        logging.info("collector={} spilled {} of {} records to disk".format(self.name, data.spilled, len(data)))
       if 'status_error' in self.__dict__:
         if len(self.status_error) > 0:
           return {'data': data, 'errors': self.status_error}
       return data
     except Exception as error:
-      if not (self.options['check_permission'] and self.check_permission(self.client, error)):
+      if not (self.options.get('check_permission') and self.check_permission(self.client, error)):
         raise
     finally:
       self.__post_request()
 
+  def fetch_stream(self, collect = None):
+    # same as fetch(), but yields records as they are produced (see InventoryStorage.save())
+    self.__pre_request()
+    try:
+      with self.stage('fetch'):
+        yield from self.__fetch_records(collect)
+    except Exception as error:
+      if not (self.options.get('check_permission') and self.check_permission(self.client, error)):
+        raise
+    finally:
+      self.__post_request()
+
+  def __fetch_records(self, collect):
+    # FQDNs are resolved in batches before records are stored
+    return self.resolver.resolve_records(self.__fetch_all(collect))
+
+  def __fetch_all(self, collect):
+    # _fetch() and resource _fetch() may return a list or yield records
+    for rec in self._resource_fetch():
+      if rec:
+        yield rec
+    if self.is_denied('collector'):
+      self.release_resources()
+      return
+    try:
+      for rec in self._fetch(collect) or []:
+        self.deadline.check()
+        if rec:
+          yield rec
+    except Exception as error:
+      if not self.permission_denied('collector', error):
+        raise
+    finally:
+      self.release_resources()
+
   def _resource_fetch(self):
     if not self.resource_manager:
-      return []
+      return
 
-    data = []
     try:
-      res = ''
-      for res in self.resource_collectors.values(): # self.resource_collectors is already ordered by dependecy
-        data.extend(res.fetch())
-      return data
-    except Exception:
-      if not (self.options['check_permission'] and self.check_permission(self.client, error)):
+      yield from self.resource_manager.fetch(self.resource_collectors, self.options.get("tasks") or 1)
+    except Exception as error:
+      if not (self.options.get('check_permission') and self.check_permission(self.client, error)):
         raise
 
   def logout(self):
     self.__pre_request()
     try:
-      res = self._logout()
+      with self.stage('logout'):
+        res = self._logout()
       return res
     except:
       raise
     finally:
       self.__post_request()
 
+  def stored(self):
+    # called after records of this collection were committed to storage
+    return self._stored()
+
+  def _stored(self):
+    pass
+
+  def share(self, child):
+    # child collectors (fan-out over accounts/regions) are accounted to this collector
+    # and reuse its immutable parts instead of building their own
+    child.usage.api = self.usage.api
+    child.usage.denied = self.usage.denied
+    child.deadline = self.deadline
+    child.serializer = self.serializer
+    child.projection = self.projection
+    child.retry = self.retry
+    child.shared = self.shared
+    child.shared_lock = self.shared_lock
+    return child
+
+  def get_shared(self, key, factory):
+    with self.shared_lock:
+      if key not in self.shared:
+        self.shared[key] = factory()
+      return self.shared[key]
+
+  def stage(self, name):
+    return self.usage.stage(name)
+
+  @property
+  def instrument(self):
+    # API call statistics, see CloudInventarioInstrument.hook_*()
+    return self.usage.api
+
+  def api_call(self, service, operation):
+    return self.usage.api.call(service, operation)
+
   def get_resource_data(self, resource):
     if resource in self.resource_collectors:
       return self.resource_collectors[resource].data
@@ -138,6 +400,20 @@ class CloudCollector:
     if resource in self.resource_collectors:
       self.resource_collectors[resource].data = new_data
 
+  def get_resource_index(self, resource, name):
+    if resource in self.resource_collectors:
+      return self.resource_collectors[resource].get_index(name)
+    else:
+      return {}
+
+  def _get_resource_indexes(self):
+    # resource: [index names] used by _fetch() (see CloudInvetarioResource._get_indexes())
+    return None
+
+  def release_resources(self):
+    for res_collector in self.resource_collectors.values():
+      res_collector.release()
+
   def load_resource_collectors(self, res_list):
     try:
       self.resource_manager = CloudInvetarioResourceManager(res_list, self.collector_pkg, self)
@@ -150,7 +426,10 @@ class CloudCollector:
     try:
       logging.debug("Getting dependencies for the following module: {}".format(self.name))
       dep_list = self._get_dependencies() or []
-      dep_list = dep_list + self.config.get('_dependencies', [])
+      # _dependencies as dict are per-resource dependencies (see CloudInvetarioResourceManager)
+      deps = self.config.get('_dependencies', [])
+      if isinstance(deps, list):
+        dep_list = dep_list + deps
       return dep_list
     except Exception:
       logging.error("Failed to get dependencies for the following collector: {}".format(self.name))
@@ -159,145 +438,247 @@ class CloudCollector:
   def _get_dependencies(self):
     return None
 
+  def limit_reached(self, rectype = None):
+    # collectors/resources should stop fetching (paginating) when limit is reached,
+    # raises CloudInventarioTimeout when the deadline expired
+    self.deadline.check()
+    return self.limiter.is_exhausted(self.name, rectype)
+
+  def resource_timeout(self, resource):
+    # "resource-timeout" is timeout of every resource or dict of resource: timeout
+    timeout = self.config.get('resource-timeout')
+    if isinstance(timeout, dict):
+      return timeout.get(resource, timeout.get('default'))
+    return timeout
+
+  def rate_limiter(self, family = None, default = None):
+    # shared token bucket of API family, configured by "rate-limit" (default is rate or {rate, burst})
+    return CloudInventarioRateLimits().get(self.name, family, self.config.get('rate-limit'), default)
+
+  def rate_limit(self, family = None, default = None, tokens = 1):
+    # use instead of sleeping between API calls
+    return self.rate_limiter(family, default).acquire(tokens)
+
+  def retry_call(self, func, *args, **kwargs):
+    # retry throttled API call, see CloudRetry
+    return self.retry.call(func, *args, **kwargs)
+
+  def rate_limited_call(self, family, default, func, *args, **kwargs):
+    # rate limited API call, throttling pauses the shared bucket of API family before retry
+    return self.retry.call_limited(self.rate_limiter(family, default), func, *args, **kwargs)
+
   def _resolve_fqdn(self, fqdn):
-    try:
-      result = self.resolver.query(fqdn, "A")
-      a_list = []
-      for val in result:
-        a_list.append(val.to_text())
-      if len(result) > 0:
-        a_list.sort()
-        return a_list[0]
-    except dns.exception.DNSException:
-      pass
-    return None
+    return self.resolver.resolve(fqdn)
 
   def new_record(self, rectype, attrs, details):
-    attr_keys = ["__table",
-                 "created", "uniqueid", "name", "project", "owner"]
-    attr_keys_inventory = [
-                 "location", "description",
-                 "cpus", "memory", "disks", "storage", "primary_ip", "primary_fqdn",
-                 "os", "os_family",
-                 "is_on"]
-    attr_keys_dns = [
-                 "domain_id", "domain_name", "ttl", "type", "data"]
-
-    # TODO: handle this in separate function !
-    if attrs.get('__table') in ['dns_domain', 'dns_record']:
-       attr_keys = attr_keys + attr_keys_dns
-    else:
-       attr_keys = attr_keys + attr_keys_inventory
+    schema = get_record_schema(attrs.get('__table'))
 
     # apply defaults
     attrs = {**self.defaults, **attrs}
 
-    attr_json_keys = [ "networks", "storages", "tags"]
-    rec = {
-      "source_id": -1,		# TODO: should be mapped during save
-      "source_name": self.name,
-      "source_version": None,
-
-      "inventory_type": rectype,
-
-      "attributes": None
-    }
-
-    check, message = self.limiter.add_counter(self.name, self.config)
+    check, message = self.limiter.add_counter(self.name, self.config, rectype)
     if not check:
       logging.warning(message)
       return None
 
-    for key in attr_keys:
-      if attrs.get(key):
-        rec[key] = attrs.pop(key)
-      else:
-        rec[key] = None
-
-    fqdn_keys = filter(lambda k: k.endswith("_fqdn"), rec.keys())
-    for key in fqdn_keys:
-      if rec[key] is not None and rec[key] != '':
-        key_ip = "{}_ip".format(key[0:-5])
-        if key_ip in rec and rec[key_ip] is None:
-          rec[key_ip] = self._resolve_fqdn(rec[key])
+    rec = schema.new(self.name, rectype)
+    values = rec.row
 
-#    for key in attr_tag_keys:
-#      data = attrs.get(key, [])
-#      rec[key] = ",".join(map(lambda k: "{}={}".format(k, data[k]), data.keys()))
+    # NOTE: keys without column (idx is None) are removed from attrs, but not stored
+    for key, idx in schema.attr_keys:
+      if attrs.get(key):
+        value = attrs.pop(key)
+        if idx is not None:
+          values[idx] = value
 
-    for key in attr_json_keys:
+    for key, idx in schema.json_keys:
       if not attrs.get(key):
-        rec[key] = '[]'
+        value = '[]'
       else:
-        rec[key] = json.dumps(attrs[key], default=str) # added default=str -> problem with AttachTime,CreateTime
+        value = self.serializer.dumps(attrs[key]) # default=str -> problem with AttachTime,CreateTime
         del(attrs[key])
+      if idx is not None:
+        values[idx] = value
 
-    for key in ["cluster", "status"]: # fields that possibly contain data structures
+    for key, idx in schema.struct_keys:
       value = attrs.get(key)
-      if not value:
-        rec[key] = None
-      else:
+      if value and idx is not None:
         if type(value) in [dict, list]:
-          rec[key] = json.dumps(value, default=str)
+          values[idx] = self.serializer.dumps(value)
         else:
-          rec[key] = value
-
+          values[idx] = value
 
-    if "os_family" not in rec and rec.get("os"):
-      rec["os_family"] = platform.get_os_family(rec.get("os"), rec.get("description"))
+    if schema.os_idx is not None and values[schema.os_idx]:
+      values[schema.os_idx] = platform.get_os(values[schema.os_idx], values[schema.description_idx])
 
-    if rec.get("os"):
-      rec["os"] = platform.get_os(rec.get("os"), rec.get("description"))
+    # drop unwanted data before it is serialized
+    attrs = self.projection.apply(rectype, 'attributes', attrs)
+    details = self.projection.apply(rectype, 'details', details)
 
     if len(attrs) > 0:
-      rec["attributes"] = json.dumps(attrs, default=str)
-    rec["details"] = json.dumps(details, cls=CloudEncoder, default=str)
+      values[schema.attributes_idx] = self.serializer.dumps(attrs)
+    values[schema.details_idx] = self.serializer.dumps(details)
+    values[schema.hash_idx] = schema.hash(values)
 
     return rec
 
   def check_permission(self, client, error):
       pass
 
+  def permission_scope(self):
+    # account/region of the collector, denied resources are remembered per scope
+    return self.name
+
+  def is_denied(self, resource):
+    # resource denied in recent run (with check_permission), it is skipped without API calls
+    if not self.options.get('check_permission'):
+      return False
+    scope = self.permission_scope()
+    found, denied = self.reference_cache.lookup('cloudinventario', None, 'permission_denied', "{}/{}".format(scope, resource))
+    if found:
+      logging.info("skipping resource={}, scope={}, permission denied: {}".format(resource, scope, denied.get('error')))
+      self.usage.denied.append({"scope": scope, "resource": resource, "error": denied.get('error'), "cached": True})
+    return found
+
+  def permission_denied(self, resource, error, client = None):
+    # True if error is permission error (with check_permission), resource is skipped for a while
+    client = client or getattr(self, 'client', None)
+    if not (self.options.get('check_permission') and self.check_permission(client, error)):
+      return False
+    scope = self.permission_scope()
+    self.reference_cache.put('cloudinventario', None, 'permission_denied', "{}/{}".format(scope, resource),
+                             {"error": str(error)}, self.config.get('permission-denied-ttl', PERMISSION_DENIED_TTL))
+    self.usage.denied.append({"scope": scope, "resource": resource, "error": str(error), "cached": False})
+    return True
+
 class CloudInvetarioResourceManager:
 
   def __init__(self, res_list, collector_pkg, collector):
     self.res_list = res_list or []
     self.collector_pkg = collector_pkg
     self.collector = collector
-    self.dep_classif = {  # dependency_classification
-      "dependency": set(),
-      "not_dependency": set(),
-    }
+    self.graph = {}   # resource -> set of resources it depends on
 
   def get_resource_objs(self, res_dep_list = []):
     obj_dict = {}
 
-    # sorting based on whether a resource needs priority in fetching or not
-    res_list = list(set((res_dep_list or []) + self.res_list))
-    for resource in res_list:
-      if resource in res_dep_list:
-        self.dep_classif["dependency"].add(resource)
-      else:
-        self.dep_classif["not_dependency"].add(resource)
-
-    res_list = []
-    res_list.extend(self.dep_classif["dependency"] or [])
-    res_list.extend(self.dep_classif["not_dependency"] or [])
-    if res_list:
-      res_list.sort()
-
-    for res in res_list:
+    # collector dependencies are loaded even if not requested
+    res_list = sorted(set((res_dep_list or []) + self.res_list))
+    while res_list:
+      res = res_list.pop(0)
+      if res in obj_dict:
+        continue
+      obj_dict[res] = self.__load_resource(res)
+
+      deps = set(obj_dict[res].get_dependencies() or [])
+      config_deps = self.collector.config.get('_dependencies')
+      if isinstance(config_deps, dict):
+        deps.update(config_deps.get(res) or [])
+      deps.discard(res)
+      self.graph[res] = deps
+      res_list.extend(sorted(deps - set(obj_dict.keys())))
+
+    # mark resources whose data is needed by the collector or other resources
+    for res in set(res_dep_list or []).union(*self.graph.values()):
+      obj_dict[res].keep_data = True
+
+    return {res: obj_dict[res] for res in self.get_resource_order()}
+
+  def __load_resource(self, res):
+    try:
+      mod_name = self.collector_pkg + ".resources." + res
+      logging.debug("Importing module: {}".format(mod_name))
+      res_mod = importlib.import_module(mod_name)
+    except Exception as e:
+      logging.error("Failed to load the following module:{}, reason: {}".format(mod_name, e))
+      raise
+    return res_mod.setup(res, self.collector)
+
+  def get_resource_order(self):
+    # topological order, alphabetical between independent resources
+    order = []
+    pending = {res: set(deps) for res, deps in self.graph.items()}
+    while pending:
+      ready = sorted(res for res, deps in pending.items() if not deps)
+      if not ready:
+        raise Exception("Dependency cycle between resources: {}".format(", ".join(sorted(pending.keys()))))
+      for res in ready:
+        del pending[res]
+        order.append(res)
+      for deps in pending.values():
+        deps.difference_update(ready)
+    return order
+
+  def fetch(self, resources, tasks = 1):
+    if tasks <= 1 or len(resources) <= 1:
+      for res in resources.values():  # resources are already ordered by dependency
+        yield from res.fetch_stream()
+      return
+
+    # run each resource as soon as its dependencies are done, records are passed
+    # through bounded queue so consumer (storage) controls the memory usage
+    records = queue.Queue(maxsize = RESOURCE_QUEUE_SIZE)
+    stop = threading.Event()
+    pending = {res: set(self.graph.get(res, [])) & set(resources.keys()) for res in resources.keys()}
+    running = 0
+
+    def put(item):
+      while not stop.is_set():
+        try:
+          records.put(item, timeout = 0.1)
+          return
+        except queue.Full:
+          pass
+      raise CloudInventarioResourceCancelled()
+
+    def run(res):
       try:
-        mod_name = self.collector_pkg + ".resources." + res
-        logging.debug("Importing module: {}".format(mod_name))
-        res_mod = importlib.import_module(mod_name)
-      except Exception as e:
-        logging.error("Failed to load the following module:{}, reason: {}".format(mod_name, e))
-        raise
-      obj_dict[res] = res_mod.setup(res, self.collector)
-
-    return obj_dict
+        for rec in resources[res].fetch_stream():
+          put((None, rec))
+        put((res, None))
+      except CloudInventarioResourceCancelled:
+        pass
+      except Exception as error:
+        put((res, error))
+
+    def get():
+      # wake up regularly to check the collector deadline
+      while True:
+        self.collector.deadline.check()
+        try:
+          return records.get(timeout = 1)
+        except queue.Empty:
+          pass
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = tasks)
+    failed = True
+    try:
+      while pending or running > 0:
+        ready = sorted(res for res, deps in pending.items() if not deps)
+        for res in ready:
+          del pending[res]
+          logging.debug("starting resource={}".format(res))
+          executor.submit(run, res)
+          running += 1
+
+        done, item = get()
+        if done is None:
+          yield item
+          continue
+
+        running -= 1
+        if item is not None:
+          raise item
+        for deps in pending.values():
+          deps.discard(done)
+      failed = False
+    finally:
+      # resources stop at their next record, do not wait for hung ones on failure
+      stop.set()
+      executor.shutdown(wait = not failed, cancel_futures = True)
 
+class CloudInventarioResourceCancelled(Exception):
+  pass
 
 class CloudInvetarioResource():
 
@@ -307,7 +688,11 @@ class CloudInvetarioResource():
     self.session = None
     self.client = None
     self.data = None
-    self.raw_data = []
+    self.keep_data = False
+    self.deadline = None
+    # derived indexes needed by the collector (see need_index()), built while fetching
+    self.index_keys = {}
+    self.indexes = {}
 
   def login(self, session):
     try:
@@ -315,15 +700,54 @@ class CloudInvetarioResource():
     except Exception:
       raise
 
+  def get_dependencies(self):
+    return self._get_dependencies() or []
+
+  def _get_dependencies(self):
+    return None
+
+  def _get_indexes(self):
+    # name: function(attrs) returning key of the record (None = not indexed)
+    return None
+
+  def need_index(self, name):
+    indexes = self._get_indexes() or {}
+    if name not in indexes:
+      raise KeyError("resource {} has no index {}".format(self.res_type, name))
+    self.index_keys[name] = indexes[name]
+
+  def get_index(self, name):
+    return self.indexes.get(name) or {}
+
+  def release(self):
+    # records and indexes are not needed once the collector finished
+    self.data = None
+    self.indexes = {}
+
   def fetch(self):
+    return list(self.fetch_stream())
+
+  def fetch_stream(self):
+    # records are only kept in self.data when other resources/collector depend on them
+    keep = self.keep_data
+    if self.collector.is_denied(self.res_type):
+      self.data = []
+      return
+    self.deadline = CloudDeadline(self.collector.resource_timeout(self.res_type), self.collector.deadline,
+                                  name = "resource {}".format(self.res_type))
     try:
       logging.debug("fetching resource={}".format(self.res_type))
-      self.raw_data = []
-      self.data = self._fetch()
-      return self.data
+      self.data = []
+      self.indexes = {name: {} for name in self.index_keys}
+      with self.collector.stage('resource_fetch:' + self.res_type):
+        for rec in self._fetch() or []:
+          self.deadline.check()
+          if keep:
+            self.data.append(rec)
+          yield rec
     except Exception as error:
-      if self.collector.options['check_permission'] and self.collector.check_permission(self.client, error):
-        return []
+      if self.collector.permission_denied(self.res_type, error, self.client):
+        return
       else:
         logging.error("Failed to fetch the data of the following type of cloud resource: {}". format(self.res_type))
         raise
@@ -353,14 +777,26 @@ class CloudInvetarioResource():
     except Exception:
       logging.error("Failed to get the data of the following of resource: {}".format(self.res_type))
 
-  def get_raw_data(self):
-    try:
-      if self.raw_data is None:
-        self.data = self.fetch()
-      return self.raw_data
-    except Exception:
-      logging.error("Failed to get the raw data of the following of resource: {}".format(self.res_type))
+  def limit_reached(self):
+    if self.deadline is not None:
+      self.deadline.check()
+    return self.collector.limit_reached(self.res_type)
+
+  def rate_limit(self, family = None, default = None, tokens = 1):
+    return self.collector.rate_limit(family or self.res_type, default, tokens)
+
+  def retry_call(self, func, *args, **kwargs):
+    return self.collector.retry_call(func, *args, **kwargs)
+
+  def rate_limited_call(self, family, default, func, *args, **kwargs):
+    return self.collector.rate_limited_call(family or self.res_type, default, func, *args, **kwargs)
+
+  def paginate(self, paginator, **kwargs):
+    return self.collector.retry.paginate(paginator, **kwargs)
 
   def new_record(self, rectype, attrs, details):
-    self.raw_data.append(attrs)
+    for name, index in self.indexes.items():
+      key = self.index_keys[name](attrs)
+      if key is not None:
+        index.setdefault(key, []).append(attrs)
     return self.collector.new_record(rectype, attrs, details)
@@ -0,0 +1,135 @@
+"""Per API call instrumentation (count, latency, errors and throttling)."""
+import re
+import time
+import threading
+import contextlib
+
+# latency histogram buckets (seconds, upper bounds)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+# error codes of throttled requests (AWS, GCP, hcloud)
+THROTTLE_CODES = ["Throttling", "ThrottlingException", "ThrottledException",
+                  "RequestLimitExceeded", "RequestThrottled", "RequestThrottledException",
+                  "TooManyRequestsException", "SlowDown", "PriorRequestNotComplete",
+                  "rateLimitExceeded", "userRateLimitExceeded", "rate_limit_exceeded"]
+# error messages of throttled requests (libcloud BaseHTTPError)
+THROTTLE_MESSAGE = re.compile(r'throttl|rate ?limit|rate exceeded|too many requests', re.IGNORECASE)
+
+def is_throttled(error = None, status = None):
+  response = getattr(error, 'response', None)
+  if isinstance(response, dict):
+    # botocore ClientError
+    if response.get('Error', {}).get('Code') in THROTTLE_CODES:
+      return True
+    status = status or response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+  elif response is not None:
+    # requests HTTPError, azure HttpResponseError
+    status = status or getattr(response, 'status_code', None)
+  # googleapiclient HttpError
+  status = status or getattr(getattr(error, 'resp', None), 'status', None)
+  # azure (status_code), libcloud/hcloud (code)
+  status = status or getattr(error, 'status_code', None)
+  code = getattr(error, 'code', None)
+  if status == 429 or code == 429 or code in THROTTLE_CODES:
+    return True
+  # libcloud
+  message = getattr(error, 'message', None)
+  return isinstance(message, str) and THROTTLE_MESSAGE.search(message) is not None
+
+class CloudInventarioInstrument:
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.stats = {}
+
+  def record(self, service, operation, duration, error = False, throttled = False):
+    key = (service, operation)
+    with self.lock:
+      stat = self.stats.get(key)
+      if stat is None:
+        stat = self.stats[key] = {
+          "count": 0, "errors": 0, "throttled": 0, "time": 0, "max": 0,
+          "buckets": [0] * len(LATENCY_BUCKETS)
+        }
+      stat["count"] += 1
+      stat["errors"] += 1 if error else 0
+      stat["throttled"] += 1 if throttled else 0
+      stat["time"] += duration
+      stat["max"] = max(stat["max"], duration)
+      for idx, bound in enumerate(LATENCY_BUCKETS):
+        if duration <= bound:
+          stat["buckets"][idx] += 1
+          break
+
+  @contextlib.contextmanager
+  def call(self, service, operation):
+    # for clients without hooks
+    start = time.time()
+    try:
+      yield
+    except Exception as e:
+      self.record(service, operation, time.time() - start, True, is_throttled(e))
+      raise
+    self.record(service, operation, time.time() - start)
+
+  def summary(self):
+    # buckets are cumulative (as in Prometheus histograms)
+    result = []
+    with self.lock:
+      for (service, operation), stat in self.stats.items():
+        buckets, total = [], 0
+        for bound, count in zip(LATENCY_BUCKETS, stat["buckets"]):
+          total += count
+          buckets.append((bound, total))
+        result.append({**stat, "service": service, "operation": operation, "buckets": buckets})
+    result.sort(key = lambda stat: stat["time"], reverse = True)
+    return result
+
+  # botocore (boto3 session or client)
+  def hook_boto3(self, session):
+    events = session.events if hasattr(session, 'events') else session.meta.events
+    events.register('before-call', self.__boto3_before)
+    events.register('after-call', self.__boto3_after)
+    events.register('after-call-error', self.__boto3_error)
+    return session
+
+  def __boto3_before(self, model, context, **kwargs):
+    context['cloudinventario_call'] = (model.service_model.service_name, model.name, time.time())
+
+  def __boto3_after(self, http_response, parsed, context, **kwargs):
+    call = context.pop('cloudinventario_call', None)
+    if call is None:
+      return
+    service, operation, start = call
+    status = getattr(http_response, 'status_code', None)
+    code = (parsed or {}).get('Error', {}).get('Code')
+    self.record(service, operation, time.time() - start,
+                error = status is not None and status >= 300,
+                throttled = status == 429 or code in THROTTLE_CODES)
+
+  def __boto3_error(self, exception, context, **kwargs):
+    call = context.pop('cloudinventario_call', None)
+    if call is None:
+      return
+    service, operation, start = call
+    self.record(service, operation, time.time() - start, True, is_throttled(exception))
+
+  # requests session, operation is method and path (without ids)
+  def hook_requests(self, session, service):
+    def response_hook(response, *args, **kwargs):
+      path = re.sub(r'/(\d+|[0-9a-fA-F-]{16,})(?=/|$)', '/{id}', response.request.path_url.split('?')[0])
+      self.record(service, "{} {}".format(response.request.method, path),
+                  response.elapsed.total_seconds(),
+                  error = response.status_code >= 400,
+                  throttled = response.status_code == 429)
+    session.hooks['response'].append(response_hook)
+    return session
+
+  # pyVmomi SOAP stub (ServiceInstance._stub), property reads show as RetrieveContents/RetrieveProperties
+  def hook_pyvmomi(self, stub, service = 'vsphere'):
+    invoke = stub.InvokeMethod
+    def invoke_method(mo, info, args, *rest, **kwargs):
+      with self.call(service, info.wsdlName):
+        return invoke(mo, info, args, *rest, **kwargs)
+    stub.InvokeMethod = invoke_method
+    return stub
@@ -1,3 +1,6 @@
+import threading
+import time
+
 class Singleton(object):
   _instances = {}
   def __new__(class_, *args, **kwargs):
@@ -7,23 +10,129 @@ class Singleton(object):
 
 class CloudInventarioLimiter(Singleton):
     def __init__(self):
+        # singleton, initialize only once
+        if hasattr(self, 'sources'):
+            return
+        self.lock = threading.Lock()
         self.sources = {}
 
     def add_source(self, name, config, counter=0):
-        if name not in self.sources:
-            self.sources[name] = {
-                "inventory-limit": config['inventory-limit'],
-                "counter": counter
-            }
-
-    def add_counter(self, name, config):
-        if name in self.sources:
-            counter = self.sources[name]['counter']
-            limit = self.sources[name]['inventory-limit']
-
-            if (counter + 1) > limit:
+        # limits of registered source are kept (children share name of parent, see reset())
+        with self.lock:
+            if name not in self.sources:
+                self.__add_source(name, config, counter)
+
+    def reset(self, name, config):
+        # new collection of the source, counters start from zero
+        with self.lock:
+            self.__add_source(name, config)
+
+    def __add_source(self, name, config, counter=0):
+        self.sources[name] = {
+            "inventory-limit": config.get('inventory-limit'),
+            "inventory-type-limit": config.get('inventory-type-limit') or {},
+            "counter": counter,
+            "types": {}
+        }
+
+    def add_counter(self, name, config, rectype=None):
+        with self.lock:
+            if name not in self.sources:
+                self.__add_source(name, config)
+            source = self.sources[name]
+
+            limit = source['inventory-limit']
+            if limit is not None and (source['counter'] + 1) > limit:
                 return False, f'Source {name} reached limit for collecting'
-            self.sources[name]['counter'] = counter + 1
-        else:
-            self.add_source(name, config, counter=1)
-        return True, ''
\ No newline at end of file
+
+            type_counter = source['types'].get(rectype, 0)
+            type_limit = source['inventory-type-limit'].get(rectype)
+            if type_limit is not None and (type_counter + 1) > type_limit:
+                return False, f'Source {name} reached limit for collecting {rectype}'
+
+            source['counter'] += 1
+            source['types'][rectype] = type_counter + 1
+        return True, ''
+
+    def is_exhausted(self, name, rectype=None):
+        # True if no more records (of rectype) would be accepted
+        with self.lock:
+            source = self.sources.get(name)
+            if source is None:
+                return False
+
+            limit = source['inventory-limit']
+            if limit is not None and source['counter'] >= limit:
+                return True
+
+            type_limit = source['inventory-type-limit'].get(rectype)
+            if type_limit is not None and source['types'].get(rectype, 0) >= type_limit:
+                return True
+        return False
+
+class CloudInventarioRateLimiter:
+    """Token bucket, rate is in calls per second (0 = unlimited)."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate or 0)
+        self.burst = float(burst or max(1, self.rate))
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def acquire(self, tokens=1):
+        # block until tokens are available, returns time waited
+        if self.rate <= 0:
+            return 0
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now > self.updated:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                if now >= self.updated and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (self.updated - now) + max(0, tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        # throttled by API, stop all users of the bucket for a while
+        with self.lock:
+            self.tokens = 0
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+class CloudInventarioRateLimits(Singleton):
+    """Rate limiters shared by all threads of the process, per (source, API family).
+
+    Config "rate-limit" is either rate for all families or dict of family: rate,
+    rate is number or dict with "rate" and "burst" keys.
+    """
+
+    def __init__(self):
+        # singleton, initialize only once
+        if hasattr(self, 'limiters'):
+            return
+        self.lock = threading.Lock()
+        self.limiters = {}
+
+    @staticmethod
+    def parse(spec):
+        if isinstance(spec, dict):
+            return spec.get('rate'), spec.get('burst')
+        return spec, None
+
+    def get(self, name, family=None, config=None, default=None):
+        spec = default
+        if isinstance(config, dict) and 'rate' not in config:
+            spec = config.get(family or 'default', config.get('default', default))
+        elif config is not None:
+            spec = config
+
+        with self.lock:
+            key = (name, family)
+            if key not in self.limiters:
+                self.limiters[key] = CloudInventarioRateLimiter(*self.parse(spec))
+            return self.limiters[key]
@@ -0,0 +1,164 @@
+"""Compact inventory records."""
+import hashlib
+from collections.abc import MutableMapping
+
+# record fields per table, in column order (keep in sync with InventoryStorage.__create_schema())
+TABLE_FIELDS = {
+  'inventory': [
+    "source_id", "source_name", "source_version", "inventory_type",
+    "uniqueid", "name", "cluster", "project", "location", "created",
+    "cpus", "memory", "disks", "storage",
+    "primary_ip", "primary_fqdn",
+    "os", "os_family",
+    "status", "is_on",
+    "networks", "storages",
+    "owner", "tags",
+    "description",
+    "attributes", "details",
+    "content_hash", "last_version"],
+  'dns_domain': [
+    "source_id", "source_name", "source_version", "inventory_type",
+    "cluster", "project", "created",
+    "uniqueid", "name", "type", "ttl",
+    "owner", "tags",
+    "description",
+    "attributes", "details",
+    "content_hash", "last_version"],
+  'dns_record': [
+    "source_id", "source_name", "source_version",
+    "domain_id", "domain_name",
+    "inventory_type",
+    "cluster", "project", "created",
+    "uniqueid", "name", "type", "ttl", "data",
+    "owner", "tags",
+    "description",
+    "attributes", "details",
+    "content_hash", "last_version"],
+  'usage_cost': [
+    "source_id", "source_name", "source_version", "inventory_type",
+    "period_type", "period_from", "period_to",
+    "cost_centre", "cost", "unit",
+    "attributes", "details", "attachment",
+    "content_hash", "last_version"],
+}
+
+# fields identifying record among versions of source (incremental save)
+TABLE_KEYS = {
+  'inventory': ["inventory_type", "uniqueid", "name", "cluster", "project"],
+  'dns_domain': ["inventory_type", "uniqueid", "name"],
+  'dns_record': ["inventory_type", "domain_name", "uniqueid", "name", "type"],
+  'usage_cost': ["inventory_type", "period_type", "period_from", "period_to", "cost_centre"],
+}
+
+# fields not part of record content (source and version bookkeeping)
+HASH_EXCLUDE = ["source_id", "source_name", "source_version", "content_hash", "last_version"]
+
+# attributes moved from new_record() attrs into the record
+ATTR_KEYS = ["__table",
+             "created", "uniqueid", "name", "project", "owner"]
+ATTR_KEYS_INVENTORY = [
+             "location", "description",
+             "cpus", "memory", "disks", "storage", "primary_ip", "primary_fqdn",
+             "os", "os_family",
+             "is_on"]
+ATTR_KEYS_DNS = [
+             "domain_id", "domain_name", "ttl", "type", "data"]
+ATTR_JSON_KEYS = ["networks", "storages", "tags"]
+ATTR_STRUCT_KEYS = ["cluster", "status"]   # fields that possibly contain data structures
+
+class CloudRecord(MutableMapping):
+  """Record backed by a list of values (row), in the order of table columns.
+
+  Behaves as a dict with a fixed set of keys, so it can be passed to
+  SQLAlchemy executemany() directly.
+  """
+  __slots__ = ('schema', 'row')
+
+  def __init__(self, schema, values = None):
+    self.schema = schema
+    self.row = values if values is not None else [None] * len(schema.fields)
+
+  @property
+  def table(self):
+    return self.schema.table
+
+  def __getitem__(self, key):
+    try:
+      return self.row[self.schema.index[key]]
+    except KeyError:
+      raise KeyError(key) from None
+
+  def __setitem__(self, key, value):
+    try:
+      self.row[self.schema.index[key]] = value
+    except KeyError:
+      raise KeyError("{} is not a field of {} records".format(key, self.schema.table)) from None
+
+  def __delitem__(self, key):
+    self[key] = None
+
+  def __contains__(self, key):
+    return key in self.schema.index
+
+  def __iter__(self):
+    return iter(self.schema.fields)
+
+  def __len__(self):
+    return len(self.schema.fields)
+
+  def __repr__(self):
+    return "CloudRecord({}, {})".format(self.schema.table, dict(zip(self.schema.fields, self.row)))
+
+  def as_tuple(self):
+    return tuple(self.row)
+
+  @property
+  def key(self):
+    return tuple(self.row[idx] for idx in self.schema.key_idx)
+
+  def rehash(self):
+    # must be called after record was modified
+    self.row[self.schema.hash_idx] = self.schema.hash(self.row)
+
+class RecordSchema:
+  """Precompiled layout of records of one table, used by new_record()."""
+
+  def __init__(self, table):
+    self.table = table
+    self.fields = tuple(TABLE_FIELDS[table])
+    self.index = {field: idx for idx, field in enumerate(self.fields)}
+
+    attr_keys = ATTR_KEYS + (ATTR_KEYS_DNS if table in ['dns_domain', 'dns_record'] else ATTR_KEYS_INVENTORY)
+    # (key, index), index is None for keys without column
+    self.attr_keys = [(key, self.index.get(key)) for key in attr_keys]
+    self.json_keys = [(key, self.index.get(key)) for key in ATTR_JSON_KEYS]
+    self.struct_keys = [(key, self.index.get(key)) for key in ATTR_STRUCT_KEYS]
+
+    self.template = [None] * len(self.fields)
+    self.template[self.index["source_id"]] = -1   # TODO: should be mapped during save
+    self.name_idx = self.index["source_name"]
+    self.type_idx = self.index["inventory_type"]
+    self.attributes_idx = self.index["attributes"]
+    self.details_idx = self.index["details"]
+    self.os_idx = self.index.get("os")
+    self.description_idx = self.index.get("description")
+
+    self.hash_idx = self.index["content_hash"]
+    self.content_idx = [idx for idx, field in enumerate(self.fields) if field not in HASH_EXCLUDE]
+    self.key_idx = [self.index[field] for field in TABLE_KEYS[table]]
+
+  def new(self, source_name, rectype):
+    values = self.template.copy()
+    values[self.name_idx] = source_name
+    values[self.type_idx] = rectype
+    return CloudRecord(self, values)
+
+  def hash(self, values):
+    # stable hash of record content (values are strings, numbers or None)
+    content = repr([values[idx] for idx in self.content_idx])
+    return hashlib.blake2b(content.encode('utf-8'), digest_size = 16).hexdigest()
+
+SCHEMAS = {table: RecordSchema(table) for table in TABLE_FIELDS.keys()}
+
+def get_record_schema(table):
+  return SCHEMAS[table or 'inventory']
@@ -0,0 +1,118 @@
+"""Disk-backed cache of slowly changing reference data (instance types, sizes, tiers, ...)."""
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+import logging
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+# default location and lifetime (seconds) of cached catalogs
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "cloudinventario-cache")
+CACHE_TTL = 86400
+
+# item used for whole catalogs
+ALL = "*"
+
+class CloudInventarioReferenceCache:
+  """Catalogs keyed by (provider, region, catalog), one JSON file per catalog.
+
+  Files are replaced atomically and updated under a file lock, so the cache
+  can be shared by forked workers. Path None (or False) keeps it in memory only.
+  """
+
+  def __init__(self, path = CACHE_DIR, ttl = CACHE_TTL):
+    self.path = path
+    self.ttl = ttl
+    self.lock = threading.Lock()
+    self.memory = {}
+
+  def __file(self, provider, region, catalog):
+    parts = [re.sub(r'[^A-Za-z0-9_.-]', '_', str(part)) for part in [provider, region or "global", catalog]]
+    return os.path.join(self.path, *parts[:-1], parts[-1] + ".json")
+
+  def __read(self, fname):
+    try:
+      with open(fname) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return {}
+
+  def __write(self, fname, items):
+    # merge with items written by other processes meanwhile
+    os.makedirs(os.path.dirname(fname), exist_ok = True)
+    with open(fname + ".lock", "a") as lock:
+      if fcntl:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+      now = time.time()
+      merged = {key: entry for key, entry in self.__read(fname).items() if entry[0] > now}
+      merged.update(items)
+      fd, tmp = tempfile.mkstemp(dir = os.path.dirname(fname), suffix = ".tmp")
+      with os.fdopen(fd, "w") as f:
+        json.dump(merged, f, default = str)
+      os.replace(tmp, fname)
+    return merged
+
+  def __catalog(self, key):
+    with self.lock:
+      catalog = self.memory.get(key)
+      if catalog is None and self.path:
+        catalog = self.memory[key] = self.__read(self.__file(*key))
+      return catalog if catalog is not None else self.memory.setdefault(key, {})
+
+  def lookup(self, provider, region, catalog, item):
+    """Return (found, value) of unexpired item."""
+    entry = self.__catalog((provider, region, catalog)).get(str(item))
+    if entry and entry[0] > time.time():
+      return True, entry[1]
+    return False, None
+
+  def put(self, provider, region, catalog, item, value, ttl = None):
+    key = (provider, region, catalog)
+    # same value on miss and on hit (as read from disk)
+    value = json.loads(json.dumps(value, default = str))
+
+    new = {str(item): [time.time() + (ttl or self.ttl), value]}
+    with self.lock:
+      self.memory[key] = {**self.memory.get(key, {}), **new}
+    if self.path:
+      try:
+        merged = self.__write(self.__file(*key), new)
+        with self.lock:
+          self.memory[key] = {**merged, **self.memory[key]}
+      except OSError as e:
+        logging.warning("failed to write reference cache path={}: {}".format(self.path, e))
+    return value
+
+  def get(self, provider, region, catalog, item, loader, ttl = None):
+    """Return item of catalog, loader(item) is called on miss (None is not cached)."""
+    found, value = self.lookup(provider, region, catalog, item)
+    if found:
+      return value
+
+    value = loader(item) if item != ALL else loader()
+    if value is None:
+      return None
+    return self.put(provider, region, catalog, item, value, ttl)
+
+  def get_all(self, provider, region, catalog, loader, ttl = None):
+    """Return whole catalog, loader() is called on miss."""
+    return self.get(provider, region, catalog, ALL, loader, ttl)
+
+REFERENCE_CACHES = {}
+REFERENCE_CACHES_LOCK = threading.Lock()
+
+def get_reference_cache(path = None, ttl = None):
+  # shared by all collectors of the process with the same path and TTL (files are shared by all)
+  if path is None:
+    path = os.getenv("CLOUDINVENTARIO_CACHE_DIR", CACHE_DIR)
+  key = (path, ttl or CACHE_TTL)
+  with REFERENCE_CACHES_LOCK:
+    if key not in REFERENCE_CACHES:
+      REFERENCE_CACHES[key] = CloudInventarioReferenceCache(*key)
+    return REFERENCE_CACHES[key]
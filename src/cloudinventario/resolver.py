@@ -0,0 +1,106 @@
+"""FQDN resolver shared by all collectors of the process."""
+import time
+import threading
+import concurrent.futures
+import dns.resolver
+import dns.exception
+
+from cloudinventario.limiter import Singleton
+from cloudinventario.record import CloudRecord
+
+# cache lifetime (seconds) of resolved and unresolvable names
+POSITIVE_TTL = 3600
+NEGATIVE_TTL = 300
+
+# parallel DNS queries and records resolved at once
+RESOLVE_TASKS = 16
+RESOLVE_BATCH = 1000
+
+class CloudInventarioResolver(Singleton):
+
+  def __init__(self):
+    # singleton, initialize only once
+    if hasattr(self, 'cache'):
+      return
+
+    self.lock = threading.Lock()
+    self.cache = {}
+
+    self.resolver = dns.resolver.Resolver()
+    self.resolver.timeout = 1
+    self.resolver.lifetime = 1
+    self.resolver.use_search_by_default = False
+
+  def __query(self, fqdn):
+    try:
+      result = self.resolver.query(fqdn, "A")
+      a_list = []
+      for val in result:
+        a_list.append(val.to_text())
+      if len(result) > 0:
+        a_list.sort()
+        return a_list[0]
+    except dns.exception.DNSException:
+      pass
+    return None
+
+  def __cached(self, fqdn, now):
+    with self.lock:
+      entry = self.cache.get(fqdn)
+    if entry and entry[1] > now:
+      return True, entry[0]
+    return False, None
+
+  def resolve(self, fqdn):
+    found, ip = self.__cached(fqdn, time.time())
+    if found:
+      return ip
+
+    ip = self.__query(fqdn)
+    with self.lock:
+      self.cache[fqdn] = (ip, time.time() + (POSITIVE_TTL if ip else NEGATIVE_TTL))
+    return ip
+
+  def resolve_all(self, fqdns, tasks = RESOLVE_TASKS):
+    result = {}
+    missing = []
+    now = time.time()
+    for fqdn in set(fqdns):
+      found, ip = self.__cached(fqdn, now)
+      if found:
+        result[fqdn] = ip
+      else:
+        missing.append(fqdn)
+
+    if len(missing) > 0:
+      with concurrent.futures.ThreadPoolExecutor(max_workers = min(tasks, len(missing))) as executor:
+        for fqdn, ip in zip(missing, executor.map(self.resolve, missing)):
+          result[fqdn] = ip
+    return result
+
+  def resolve_records(self, records, batch = RESOLVE_BATCH, tasks = RESOLVE_TASKS):
+    # fill empty "*_ip" fields from their "*_fqdn" pairs, batch by batch
+    chunk = []
+    for rec in records:
+      chunk.append(rec)
+      if len(chunk) >= batch:
+        yield from self.__resolve_chunk(chunk, tasks)
+        chunk = []
+    yield from self.__resolve_chunk(chunk, tasks)
+
+  def __resolve_chunk(self, chunk, tasks):
+    pending = []
+    for rec in chunk:
+      for key in rec.keys():
+        if key.endswith("_fqdn") and rec[key]:
+          key_ip = "{}_ip".format(key[0:-5])
+          if key_ip in rec and rec[key_ip] is None:
+            pending.append((rec, key_ip, rec[key]))
+
+    if len(pending) > 0:
+      ips = self.resolve_all([fqdn for rec, key_ip, fqdn in pending], tasks)
+      for rec, key_ip, fqdn in pending:
+        rec[key_ip] = ips.get(fqdn)
+        if isinstance(rec, CloudRecord):
+          rec.rehash()
+    return chunk
@@ -1,18 +1,93 @@
-import logging, re
+import logging, re, time, os, threading, io
 from pkgutil import iter_modules
 from pprint import pprint
 from datetime import datetime, timedelta
-from sqlalchemy.pool import NullPool
 import json
 
 import sqlalchemy as sa
 
+from cloudinventario.record import CloudRecord, TABLE_KEYS
+from cloudinventario.buffer import CloudInventarioBuffer
+
 TABLE_PREFIX = "ci_"
 
 STATUS_OK = "OK"
 STATUS_FAIL = "FAIL"
 STATUS_ERROR = "ERROR"
 
+# records inserted per executemany() in save()
+BATCH_SIZE = 1000
+
+# connection pool of process-wide engines (see get_engine())
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 10
+POOL_RECYCLE = 3600
+
+# pragmas of SQLite connections (file databases), overridden by "sqlite_pragmas" of storage config
+SQLITE_PRAGMAS = {
+  "journal_mode": "WAL",
+  "synchronous": "NORMAL",
+  "mmap_size": 268435456
+}
+
+ENGINES = {}
+ENGINES_LOCK = threading.Lock()
+
+def get_engine(dsn, config = None):
+   # one pooled engine per DSN, shared by all storages (and threads) of the process
+   config = config or {}
+   key = (os.getpid(), dsn)
+   with ENGINES_LOCK:
+     engine = ENGINES.get(key)
+     if engine is None:
+       url = sa.engine.make_url(dsn)
+       pool = {}
+       # in-memory SQLite has its own (per thread) pool
+       if not (url.get_backend_name() == "sqlite" and url.database in [None, "", ":memory:"]):
+         pool = {
+           "pool_size": int(config.get("pool_size", POOL_SIZE)),
+           "max_overflow": int(config.get("pool_max_overflow", POOL_MAX_OVERFLOW)),
+           "pool_recycle": int(config.get("pool_recycle", POOL_RECYCLE)),
+           "pool_pre_ping": True
+         }
+       engine = ENGINES[key] = sa.create_engine(dsn, echo=False, **pool)
+       if url.get_backend_name() == "sqlite" and pool:
+         _set_sqlite_pragmas(engine, {**SQLITE_PRAGMAS, **config.get("sqlite_pragmas", {})})
+     return engine
+
+def _set_sqlite_pragmas(engine, pragmas):
+   @sa.event.listens_for(engine, "connect")
+   def set_pragmas(dbapi_conn, conn_record):
+     cursor = dbapi_conn.cursor()
+     for name, value in pragmas.items():
+       if value is not None:
+         cursor.execute("PRAGMA {}={}".format(name, value))
+     cursor.close()
+
+def _reset_engines():
+   # connections inherited from parent must not be used (nor closed) by forked child
+   global ENGINES_LOCK
+   ENGINES_LOCK = threading.Lock()
+   for engine in ENGINES.values():
+     engine.dispose(close=False)
+   ENGINES.clear()
+
+if hasattr(os, "register_at_fork"):
+   os.register_at_fork(after_in_child=_reset_engines)
+
+# revision of schema created by __create_schema(), see __migrate_schema()
+SCHEMA_VERSION = 3
+
+# DSNs with schema checked (and migrated) by this process (or its parent)
+SCHEMA_CHECKED = set()
+SCHEMA_LOCK = threading.Lock()
+
+# advisory lock (PostgreSQL) serializing migrations of concurrent processes
+SCHEMA_LOCK_KEY = 0x43490001
+# attempts (and delay in seconds) of migrations failed by concurrent DDL
+SCHEMA_RETRIES = 5
+SCHEMA_RETRY_DELAY = 0.2
+
 class InventoryStorage:
 
    def __init__(self, config):
@@ -27,24 +102,32 @@ class InventoryStorage:
    def __del__(self):
      if self.conn:
        self.disconnect()
-     self.engine.dispose()
 
    def __create(self):
-     return sa.create_engine(self.dsn, echo=False, poolclass=NullPool)
+     return get_engine(self.dsn, self.config)
 
    def connect(self):
      self.conn = self.engine.connect()
      #self.conn.execution_options(autocommit=True)
+     self.__create_schema()
      if not self.__check_schema():
-       self.__create_schema()
+       self.__migrate_schema()
      self.__prepare()
      return True
 
    def __check_schema(self):
-     return False
+     # schema is checked once per process and DSN
+     return self.dsn in SCHEMA_CHECKED
 
    def __create_schema(self):
      meta = sa.MetaData()
+     self.meta = meta
+     self.schema_table = sa.Table(TABLE_PREFIX + 'schema_version', meta,
+       sa.Column('version', sa.Integer, primary_key=True, autoincrement=False),
+       sa.Column('ts', sa.String, default=sa.func.now()),
+       sa.Column('description', sa.String),
+     )
+
      self.source_table = sa.Table(TABLE_PREFIX + 'source', meta,
        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
 
@@ -57,7 +140,14 @@ class InventoryStorage:
        sa.Column('status', sa.String),
        sa.Column('error', sa.Text),
 
-       sa.UniqueConstraint('source', 'version')
+       sa.UniqueConstraint('source', 'version'),
+       sa.Index('ix_ci_source_ts', 'ts')
+     )
+
+     # last allocated version of every source (see __next_version())
+     self.current_version_table = sa.Table(TABLE_PREFIX + 'current_version', meta,
+       sa.Column('source', sa.String, primary_key=True),
+       sa.Column('version', sa.Integer, nullable=False),
      )
 
      self.inventory_table = sa.Table(TABLE_PREFIX + 'inventory', meta,
@@ -100,7 +190,17 @@ class InventoryStorage:
        sa.Column('attributes', sa.Text),
        sa.Column('details', sa.Text),
 
-       sa.UniqueConstraint('source_version', 'source_name', 'inventory_type', 'name', "cluster", 'project', 'uniqueid')
+       # incremental save, record is valid in versions source_version..last_version
+       sa.Column('content_hash', sa.String),
+       sa.Column('last_version', sa.Integer),
+
+       sa.UniqueConstraint('source_version', 'source_name', 'inventory_type', 'name', "cluster", 'project', 'uniqueid'),
+       sa.Index('ix_ci_inventory_source', 'source_name', 'source_version'),
+       sa.Index('ix_ci_inventory_last_version', 'source_name', 'last_version'),
+       sa.Index('ix_ci_inventory_type', 'inventory_type'),
+       sa.Index('ix_ci_inventory_uniqueid', 'uniqueid'),
+       sa.Index('ix_ci_inventory_primary_ip', 'primary_ip'),
+       sa.Index('ix_ci_inventory_name', 'name')
      )
 
      self.dns_domain = sa.Table(TABLE_PREFIX + 'dns_domain', meta,
@@ -129,7 +229,16 @@ class InventoryStorage:
        sa.Column('attributes', sa.Text),
        sa.Column('details', sa.Text),
 
+       # incremental save, record is valid in versions source_version..last_version
+       sa.Column('content_hash', sa.String),
+       sa.Column('last_version', sa.Integer),
+
        #sa.UniqueConstraint('source_version', 'source_name', 'inventory_type', 'name', 'uniqueid')  # TODO !
+       sa.Index('ix_ci_dns_domain_source', 'source_name', 'source_version'),
+       sa.Index('ix_ci_dns_domain_last_version', 'source_name', 'last_version'),
+       sa.Index('ix_ci_dns_domain_type', 'inventory_type'),
+       sa.Index('ix_ci_dns_domain_uniqueid', 'uniqueid'),
+       sa.Index('ix_ci_dns_domain_name', 'name')
      )
 
      self.dns_record = sa.Table(TABLE_PREFIX + 'dns_record', meta,
@@ -162,7 +271,16 @@ class InventoryStorage:
        sa.Column('attributes', sa.Text),
        sa.Column('details', sa.Text),
 
+       # incremental save, record is valid in versions source_version..last_version
+       sa.Column('content_hash', sa.String),
+       sa.Column('last_version', sa.Integer),
+
        #sa.UniqueConstraint('source_version', 'source_name', 'inventory_type', 'name', 'uniqueid') # TODO !
+       sa.Index('ix_ci_dns_record_source', 'source_name', 'source_version'),
+       sa.Index('ix_ci_dns_record_last_version', 'source_name', 'last_version'),
+       sa.Index('ix_ci_dns_record_type', 'inventory_type'),
+       sa.Index('ix_ci_dns_record_uniqueid', 'uniqueid'),
+       sa.Index('ix_ci_dns_record_name', 'name')
      )
 
      self.usage_cost = sa.Table(TABLE_PREFIX + 'usage_cost', meta,
@@ -185,9 +303,14 @@ class InventoryStorage:
        sa.Column('attributes', sa.Text),
        sa.Column('details', sa.Text),
        sa.Column('attachment', sa.LargeBinary),
-     )
 
-     meta.create_all(self.engine, checkfirst = True)
+       sa.Column('content_hash', sa.String),
+       sa.Column('last_version', sa.Integer),
+
+       sa.Index('ix_ci_usage_cost_source', 'source_name', 'source_version'),
+       sa.Index('ix_ci_usage_cost_last_version', 'source_name', 'last_version'),
+       sa.Index('ix_ci_usage_cost_type', 'inventory_type')
+     )
 
      self.TABLES = {
        'inventory':  self.inventory_table,
@@ -197,55 +320,141 @@ class InventoryStorage:
      }
      return True
 
+   def __migrations(self):
+     # (version, description, function(conn)), applied in order to older schemas
+     return [
+       (1, "initial schema, columns of incremental save", self.__migrate_initial),
+       (2, "current version of sources", self.__migrate_current_version),
+       (3, "indexes of version and lookup queries", self.__migrate_indexes),
+     ]
+
+   def __migrate_schema(self):
+     with SCHEMA_LOCK:
+       if self.dsn in SCHEMA_CHECKED:
+         return True
+
+       self.__retry_ddl(lambda: self.schema_table.create(self.engine, checkfirst = True),
+                        lambda: sa.inspect(self.engine).has_table(self.schema_table.name))
+       current = self.__get_schema_version()
+       if current > SCHEMA_VERSION:
+         logging.warning("schema version={} of dsn={} is newer than version={} of this release".format(current, self.engine.url, SCHEMA_VERSION))
+       for version, description, migration in self.__migrations():
+         if version <= current:
+           continue
+         if not self.__retry_ddl(lambda: self.__migrate(version, description, migration),
+                                 lambda: self.__get_schema_version() >= version):
+           # migrated by other process meanwhile
+           logging.info("schema version={} already applied".format(version))
+         current = version
+       SCHEMA_CHECKED.add(self.dsn)
+     return True
+
+   def __migrate(self, version, description, migration):
+     with self.engine.begin() as conn:
+       self.__lock_schema(conn)
+       if self.__get_schema_version(conn) >= version:
+         return False
+       logging.info("migrating schema dsn={} to version={}: {}".format(self.engine.url, version, description))
+       migration(conn)
+       conn.execute(self.schema_table.insert(), {"version": version, "description": description})
+     return True
+
+   def __lock_schema(self, conn):
+     # serialize migrations of concurrent processes (lock is released by commit)
+     if conn.dialect.name == "postgresql":
+       conn.execute(sa.text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+
+   def __retry_ddl(self, func, done):
+     # DDL of other processes (not serialized by SQLite) may fail ours, migrations
+     # are idempotent, so they are retried unless done() meanwhile
+     for attempt in range(SCHEMA_RETRIES):
+       try:
+         return func()
+       except sa.exc.DBAPIError as e:
+         if done():
+           return False
+         if attempt == SCHEMA_RETRIES - 1:
+           raise
+         logging.info("schema migration of dsn={} failed, retrying: {}".format(self.engine.url, e.orig))
+         time.sleep(SCHEMA_RETRY_DELAY * (attempt + 1))
+
+   def __get_schema_version(self, conn = None):
+     if conn is not None:
+       return conn.execute(sa.select(sa.func.max(self.schema_table.c.version))).scalar() or 0
+     with self.engine.connect() as conn:
+       return self.__get_schema_version(conn)
+
+   def __migrate_initial(self, conn):
+     self.meta.create_all(conn, checkfirst = True)
+     self.__migrate_columns(conn)
+
+   def __migrate_current_version(self, conn):
+     # seeded from ci_source on first allocation of every source
+     self.current_version_table.create(conn, checkfirst = True)
+
+   def __migrate_indexes(self, conn):
+     for table in self.meta.sorted_tables:
+       for index in table.indexes:
+         index.create(conn, checkfirst = True)
+
+   def __migrate_columns(self, conn):
+     # add columns missing in tables created by older versions
+     inspector = sa.inspect(conn)
+     for table in self.meta.sorted_tables:
+       existing = [col["name"] for col in inspector.get_columns(table.name)]
+       for col in table.columns:
+         if col.name not in existing:
+           logging.info("adding column {}.{}".format(table.name, col.name))
+           conn.execute(sa.text("ALTER TABLE {} ADD COLUMN {} {}".format(
+             table.name, col.name, col.type.compile(dialect = conn.dialect))))
+
    def __prepare(self):
-     pass
-
-   def __get_sources_version_max(self):
-     # get active version
-    #  res = self.conn.execute(sa.select([
-    #                self.source_table.c.source,
-    #                sa.func.max(self.source_table.c.version).label("version")
-    #                ])
-    #  	              .group_by(self.source_table.c.source)
-    #                 )
-    #  res = res.fetchall()
-    #  if res and res[0]['version']:
-    #    sources = [dict(row) for row in res]
-    #  else:
-    #    sources = []
-     res = self.conn.execute(sa.select(
-                   self.source_table.c.source,
-                   sa.func.max(self.source_table.c.version).label("version")
-                   )
-     	              .group_by(self.source_table.c.source)
-                    )
-     res = res.fetchall()
-     if res and res[0][1]:
-       sources = [{"source": row[0], "version": row[1]} for row in res]
+     # bulk loader of records, chosen by backend ("loader": "generic" disables it,
+     # "copy" enables COPY loader of PostgreSQL)
+     loader = self.config.get("loader", "auto")
+     dialect = self.engine.dialect.name
+     if loader == "generic":
+       self.loader = self.__load_generic
+     elif dialect == "postgresql" and loader == "copy":
+       self.loader = self.__load_copy
+     elif dialect == "sqlite":
+       self.loader = self.__load_sqlite
      else:
-       sources = []
-     return sources
-
-   def __get_source_version_max(self, name):
-     sources = self.__get_sources_version_max()
-     for source in sources:
-       if name == source["source"]:
-         return source["version"]
-     return 0
+       self.loader = self.__load_generic
+     self.insert_sql = {}
+     self.copy_formatters = {}
+
+   def __get_source_version_max(self, conn, name):
+     # highest version in history of source (uses unique index on source, version)
+     return conn.execute(sa.select(sa.func.max(self.source_table.c.version))
+                           .where(self.source_table.c.source == name)).scalar() or 0
+
+   def __next_version(self, conn, name):
+     # allocate version of source, row stays locked until the transaction ends
+     tbl = self.current_version_table
+     res = conn.execute(tbl.update().where(tbl.c.source == name).values(version = tbl.c.version + 1))
+     if res.rowcount == 0:
+       # first allocation, continue history of source
+       version = self.__get_source_version_max(conn, name) + 1
+       try:
+         with conn.begin_nested():
+           conn.execute(tbl.insert(), {"source": name, "version": version})
+         return version
+       except sa.exc.IntegrityError:
+         # allocated by other process meanwhile
+         conn.execute(tbl.update().where(tbl.c.source == name).values(version = tbl.c.version + 1))
+     return conn.execute(sa.select(tbl.c.version).where(tbl.c.source == name)).scalar()
 
    def log_status(self, source, status, runtime = None, error = None):
-     version = self.__get_source_version_max(source)
-
-     data = {
-       "source_id": -1,
-       "source": source,
-       "version": version + 1,
-       "status": status,
-       "runtime": runtime,
-       "error": error
-     }
-
      with self.engine.begin() as conn:
+       data = {
+         "source_id": -1,
+         "source": source,
+         "version": self.__next_version(conn, source),
+         "status": status,
+         "runtime": runtime,
+         "error": error
+       }
        conn.execute(self.source_table.insert(), data)
      return True
 
@@ -253,97 +462,241 @@ class InventoryStorage:
      if data is None:
        return False
 
-     # define array of sources_save to save 
-     sources_save = []
+     errors = []
      if type(data) is dict:
-      for error in data['errors']:
-        error['version'] = self.__get_source_version_max(error['source']) + 1
-      sources_save += data['errors']
-      data = data['data']
-
-     sources = self.__get_sources_version_max()
-
-     # increment versions
-     versions = {}
-     for source in sources:
-       source["version"] += 1
-       versions[source["source"]] = source["version"]
-
-     # collect data sources versions
-     source_entries = {}
-     for rec in data:
-       if rec["source_name"] not in versions.keys():
-         versions[rec["source_name"]] = 1
-         sources.append({ "source": rec["source_name"],
-                          "version": versions[rec["source_name"]] })
-       rec["source_version"] = versions.get(rec["source_name"], 1)
-       source_entries.setdefault(rec["source_name"], 0)
-       source_entries[rec["source_name"]] += 1
-
-     # save entry counts
-     for source in sources:
-       if not source["source"] in source_entries:
-         continue
-       source["entries"] = source_entries[source["source"]]
-       source["status"] = STATUS_OK
-       source["runtime"] = runtime
-       sources_save.append(source)
-
-     # known tables
-     data_to_insert = dict()
-     for table in self.TABLES.keys():
-       data_to_insert[table] = []
-
-     for item in data:
-         table = item.pop('__table', 'inventory') or 'inventory'
-
-         data_to_insert[table].append(item)
-
-     if len(sources_save) == 0:
-       return False
-     # store data
+       errors = data['errors']
+       data = data['data']
 
-     with self.engine.begin() as conn:
-      sources = dict()
-
-      for source_save in sources_save:
-        result = conn.execute(self.source_table.insert(), [source_save])
+     # data may be a generator (streaming mode), collection runs while we save,
+     # or a buffer of collected records (possibly spilled to disk)
+     streamed = not isinstance(data, (list, CloudInventarioBuffer))
+     save_start = time.time()
+     batch_size = int(self.config.get("batch_size", BATCH_SIZE))
+     # unchanged records are not inserted again, their last_version is raised instead
+     incremental = self.config.get("incremental", False)
 
-        for index, source in enumerate([source_save]):
-          sources[source['source'] + '|' + str(source['version'])] = result.inserted_primary_key[index]
+     # store data
+     with self.engine.begin() as conn:
+       for error in errors:
+         error['version'] = self.__next_version(conn, error['source'])
+         conn.execute(self.source_table.insert(), [error])
+
+       # known tables
+       batch = dict()
+       for table in self.TABLES.keys():
+         batch[table] = []
+
+       sources = dict()
+       previous = dict()
+       carried = dict()
+       pending = 0
+       for rec in data:
+         if not rec:
+           continue
+
+         source = sources.get(rec["source_name"])
+         if source is None:
+           source = self.__save_source(conn, rec["source_name"], self.__next_version(conn, rec["source_name"]), runtime)
+           sources[rec["source_name"]] = source
+         source["entries"] += 1
+
+         if isinstance(rec, CloudRecord):
+           table = rec.table
+         else:
+           table = rec.pop('__table', 'inventory') or 'inventory'
+
+         if incremental and isinstance(rec, CloudRecord):
+           prev_key = (rec["source_name"], table)
+           if prev_key not in previous:
+             if "previous" not in source:
+               source["previous"] = self.__get_previous_version(conn, rec["source_name"], source["version"])
+             previous[prev_key] = self.__get_previous(conn, table, rec["source_name"], source["previous"])
+           prev = previous[prev_key].pop(self.__record_key(rec.key), None)
+           if prev and prev[1] is not None and prev[1] == rec["content_hash"]:
+             carried.setdefault((table, source["version"], source["id"]), []).append(prev[0])
+             pending += 1
+             if pending >= batch_size:
+               self.__save_batch(conn, batch)
+               self.__save_carried(conn, carried)
+               pending = 0
+             continue
+
+         rec["source_id"] = source["id"]
+         rec["source_version"] = source["version"]
+         rec["last_version"] = source["version"]
+
+         batch[table].append(rec)
+         pending += 1
+         if pending >= batch_size:
+           self.__save_batch(conn, batch)
+           self.__save_carried(conn, carried)
+           pending = 0
+       self.__save_batch(conn, batch)
+       self.__save_carried(conn, carried)
+
+       if streamed:
+         runtime = (runtime or 0) + (time.time() - save_start)
+
+       # save entry counts
+       for source in sources.values():
+         conn.execute(self.source_table.update()
+                        .where(self.source_table.c.id == source["id"])
+                        .values(entries = source["entries"], runtime = runtime))
+
+     if isinstance(data, CloudInventarioBuffer):
+       data.close()
+
+     if len(errors) == 0 and len(sources) == 0:
+       return False
+     return True
 
-      for table in data_to_insert.keys():
-        if len(data_to_insert[table]) > 0:
-          for item in data_to_insert[table]:
-            item['source_id'] = sources[item['source_name'] + "|" + str(item['source_version'])]
+   def __save_source(self, conn, name, version, runtime):
+     result = conn.execute(self.source_table.insert(), [{
+       "source": name,
+       "version": version,
+       "entries": 0,
+       "status": STATUS_OK,
+       "runtime": runtime
+     }])
+     return {
+       "id": result.inserted_primary_key[0],
+       "version": version,
+       "entries": 0
+     }
 
-          conn.execute(self.TABLES[table].insert(), data_to_insert[table])
-     return True
+   def __save_batch(self, conn, batch):
+     for table in batch.keys():
+       if len(batch[table]) > 0:
+         self.loader(conn, self.TABLES[table], batch[table])
+         batch[table] = []
+
+   def __load_generic(self, conn, table, records):
+     conn.execute(table.insert(), records)
+
+   def __is_compact(self, records):
+     # fast loaders need CloudRecords (values in column order), plain dicts use generic insert
+     return all(isinstance(rec, CloudRecord) for rec in records)
+
+   def __load_sqlite(self, conn, table, records):
+     # executemany() of tuples with one (cached) prepared statement
+     if not self.__is_compact(records):
+       return self.__load_generic(conn, table, records)
+     fields = records[0].schema.fields
+     sql = self.insert_sql.get(table.name)
+     if sql is None:
+       sql = self.insert_sql[table.name] = "INSERT INTO {} ({}) VALUES ({})".format(
+                table.name, ", ".join(fields), ", ".join(["?"] * len(fields)))
+     conn.exec_driver_sql(sql, [rec.as_tuple() for rec in records])
+
+   def __csv_value(self, value):
+     # NULL is unquoted empty value, strings are always quoted
+     if value is None:
+       return ''
+     if isinstance(value, bool):
+       return '1' if value else '0'
+     if isinstance(value, (int, float)):
+       return str(value)
+     if isinstance(value, (bytes, bytearray, memoryview)):
+       value = '\\x' + bytes(value).hex()
+     return '"' + str(value).replace('"', '""') + '"'
+
+   def __csv_integer(self, value):
+     # collectors may pass floats (e.g. memory), COPY does not cast them as INSERT does (rint)
+     if isinstance(value, float):
+       value = int(round(value))
+     return self.__csv_value(value)
+
+   def __get_copy_formatters(self, table, fields):
+     formatters = self.copy_formatters.get(table.name)
+     if formatters is None:
+       formatters = self.copy_formatters[table.name] = [
+         self.__csv_integer if isinstance(table.c[field].type, sa.Integer) else self.__csv_value
+           for field in fields]
+     return formatters
+
+   def __load_copy(self, conn, table, records):
+     # COPY ... FROM STDIN (CSV) in the transaction of conn (psycopg2 or psycopg 3)
+     if not self.__is_compact(records):
+       return self.__load_generic(conn, table, records)
+     fields = records[0].schema.fields
+     formatters = self.__get_copy_formatters(table, fields)
+     data = io.StringIO()
+     for rec in records:
+       data.write(",".join(fmt(value) for fmt, value in zip(formatters, rec.row)))
+       data.write("\n")
+     sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(table.name, ", ".join(fields))
+
+     cursor = conn.connection.dbapi_connection.cursor()
+     try:
+       data.seek(0)
+       if hasattr(cursor, "copy_expert"):
+         cursor.copy_expert(sql, data)
+       else:
+         with cursor.copy(sql) as copy:
+           copy.write(data.getvalue())
+     finally:
+       cursor.close()
+
+   def __record_key(self, key):
+     # keys as returned by DB (strings)
+     return tuple(None if val is None else str(val) for val in key)
+
+   def __get_previous_version(self, conn, source_name, version):
+     # last stored version of source before version (failed and error entries have no records)
+     return conn.execute(sa.select(sa.func.max(self.source_table.c.version))
+                           .where((self.source_table.c.source == source_name) &
+                                    (self.source_table.c.version < version) &
+                                    (self.source_table.c.status == STATUS_OK))).scalar()
+
+   def __get_previous(self, conn, table, source_name, version):
+     # records of previous version of source, key -> (id, content_hash);
+     # records missing in it (of any table) are inserted again
+     if version is None:
+       return dict()
+     tbl = self.TABLES[table]
+     res = conn.execute(sa.select(tbl.c.id, tbl.c.content_hash, *[tbl.c[field] for field in TABLE_KEYS[table]])
+                          .where((tbl.c.source_name == source_name) & (tbl.c.last_version == version)))
+     previous = dict()
+     for row in res:
+       previous[self.__record_key(row[2:])] = (row[0], row[1])
+     return previous
+
+   def __save_carried(self, conn, carried):
+     # source_id points to the latest version, older ci_source rows may be pruned
+     for (table, version, source_id), ids in carried.items():
+       if len(ids) > 0:
+         tbl = self.TABLES[table]
+         conn.execute(tbl.update().where(tbl.c.id.in_(ids)).values(last_version = version, source_id = source_id))
+     carried.clear()
 
    def cleanup(self, days):
-     res = self.conn.execute(sa.select([
+     res = self.conn.execute(sa.select(
                    self.source_table.c.source,
-                   self.source_table.c.version])
+                   self.source_table.c.version)
 		.where(self.source_table.c.ts <= datetime.today() - timedelta(days=days)))
      res = res.fetchall()
 
      with self.engine.begin() as conn:
-       for row in res:
-         logging.debug("prune: source={}, version={}".format(row["source"], row["version"]))
+       for source, version in res:
+         logging.debug("prune: source={}, version={}".format(source, version))
          conn.execute(self.source_table.delete().where(
-               (self.source_table.c.source == row["source"]) &
-                  (self.source_table.c.version == row["version"])
+               (self.source_table.c.source == source) &
+                  (self.source_table.c.version == version)
            ))
 
+         # records carried to newer versions (incremental save) are kept,
+         # records saved without last_version (older releases) are deleted by source_version
+         # (two statements, so both use indexes)
          for table in self.TABLES.keys():
-           conn.execute(self.TABLES[table].delete().where(
-                 (self.TABLES[table].c.source_name == row["source"]) &
-                    (self.TABLES[table].c.source_version == row["version"])
-             ))
+           tbl = self.TABLES[table]
+           conn.execute(tbl.delete().where(
+                 (tbl.c.source_name == source) & (tbl.c.last_version == version)))
+           conn.execute(tbl.delete().where(
+                 (tbl.c.source_name == source) & (tbl.c.source_version == version) & (tbl.c.last_version == None)))
      return True
 
    def disconnect(self):
-     self.conn.invalidate()
+     # connection is returned to the pool
      self.conn.close()
      self.conn = None
      return True
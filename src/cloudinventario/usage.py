@@ -0,0 +1,116 @@
+"""Stage tracking and resource usage accounting of collectors (without sampling/sleeping)."""
+import time
+import resource
+import threading
+import contextlib
+
+from cloudinventario.instrument import CloudInventarioInstrument
+
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+class CloudInventarioUsage:
+  """Usage of one collection, reset_peak only for the top-level one (peak RSS is process-wide)."""
+
+  def __init__(self, reset_peak = False):
+    self.lock = threading.Lock()
+    self.reset_peak = reset_peak
+    self.stages = {}
+    self.active = 0
+    self.failed_stage = None
+    self.mem_peak = 0
+    # API calls made by collector (and its resources)
+    self.api = CloudInventarioInstrument()
+    # resources skipped because of missing permissions
+    self.denied = []
+    self.start = self.__sample(reset = reset_peak)
+
+  def __cpu_time(self):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+  def __reset_mem_peak(self):
+    # Linux only, resets VmHWM (peak RSS) of the process
+    try:
+      with open(PROC_CLEAR_REFS, "w") as f:
+        f.write("5")
+    except OSError:
+      pass
+
+  def __read_mem_peak(self):
+    try:
+      with open(PROC_STATUS) as f:
+        for line in f:
+          if line.startswith("VmHWM:"):
+            return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+      pass
+    # peak of the whole process lifetime (KiB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+  def __sample(self, reset = False):
+    if reset:
+      self.__reset_mem_peak()
+    return {
+      "time": time.time(),
+      "cpu_time": self.__cpu_time(),
+    }
+
+  def __delta(self, start):
+    end = self.__sample()
+    mem_peak = self.__read_mem_peak()
+    self.mem_peak = max(self.mem_peak, mem_peak)
+
+    runtime = end["time"] - start["time"]
+    cpu_time = end["cpu_time"] - start["cpu_time"]
+    return {
+      "runtime": runtime,
+      "cpu_time": cpu_time,
+      "cpu_usage": (cpu_time / runtime * 100) if runtime > 0 else 0,
+      "mem_peak": mem_peak
+    }
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    # peak RSS is only reset by outermost stage (stages may be nested or run in threads)
+    with self.lock:
+      reset = (self.active == 0) and self.reset_peak
+      self.active += 1
+    start = self.__sample(reset = reset)
+    error = None
+    try:
+      yield
+    except Exception as e:
+      error = e
+      # innermost stage is the failing one
+      if getattr(e, 'cloudinventario_stage', None) is None:
+        try:
+          e.cloudinventario_stage = name
+        except AttributeError:
+          pass
+      raise
+    finally:
+      usage = self.__delta(start)
+      usage["start"] = start["time"]
+      usage["end"] = start["time"] + usage["runtime"]
+      usage["error"] = error is not None
+      with self.lock:
+        self.active -= 1
+        self.stages[name] = usage
+        if error is not None and self.failed_stage is None:
+          self.failed_stage = name
+
+  def get_failed_stage(self, error = None):
+    # stage where error was raised, or first failed stage
+    return getattr(error, 'cloudinventario_stage', None) or self.failed_stage
+
+  def summary(self):
+    # totals since start, mem_peak is the highest peak of all stages
+    result = self.__delta(self.start)
+    result["mem_peak"] = self.mem_peak
+    with self.lock:
+      result["stages"] = {**self.stages}
+    result["failed_stage"] = self.failed_stage
+    result["api"] = self.api.summary()
+    result["denied"] = list(self.denied)
+    return result
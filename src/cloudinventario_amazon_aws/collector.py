@@ -3,6 +3,7 @@ import logging, re, sys, asyncio, time
 from pprint import pprint
 
 import boto3
+import botocore.session
 
 from cloudinventario_amazon_aws_resource.collector import CloudInvetarioAmazonAWSResource
 from cloudinventario.helpers import CloudCollector, CloudInvetarioResourceManager
@@ -31,6 +32,9 @@ class CloudCollectorAmazonAWS(CloudInvetarioAmazonAWSResource):
     return []
     # return ["ebs"]
 
+  def _get_resource_indexes(self):
+    return {"ebs": ["instance"]}
+
   def _login(self):
     access_key = self.config['access_key']
     secret_key = self.config['secret_key']
@@ -43,7 +47,7 @@ class CloudCollectorAmazonAWS(CloudInvetarioAmazonAWSResource):
       logging.getLogger(logger).setLevel(logging.WARNING)
 
     if self.account_id is None:
-      sts = boto3.client('sts', aws_access_key_id = access_key, aws_secret_access_key = secret_key)
+      sts = self.instrument.hook_boto3(boto3.client('sts', aws_access_key_id = access_key, aws_secret_access_key = secret_key))
       ident = sts.get_caller_identity()
       self.account_id = ident['Account']
 
@@ -52,47 +56,62 @@ class CloudCollectorAmazonAWS(CloudInvetarioAmazonAWSResource):
 
     logging.info("logging in AWS account_id={}, region={}".format(self.account_id, region))
     self.session = boto3.Session(aws_access_key_id = access_key, aws_secret_access_key = secret_key,
-                                  aws_session_token = session_token, region_name = region)
+                                  aws_session_token = session_token, region_name = region,
+                                  botocore_session = self._botocore_session())
+    self.instrument.hook_boto3(self.session)
     self.client = self.session.client('ec2')
 
     self.instance_types = {}
 
     return self.session
 
+  def permission_scope(self):
+    return "aws/{}/{}".format(self.account_id, self.region)
+
+  def _botocore_session(self):
+    # service models are parsed once per shared loader (aws-multi children share it)
+    session = botocore.session.get_session()
+    loader = self.get_shared('botocore_loader', lambda: session.get_component('data_loader'))
+    session.register_component('data_loader', loader)
+    return session
+
   def _fetch(self, collect):
-    data = []
     next_token = ""
-    while True:
-      instances = self.client.describe_instances(MaxResults=100, NextToken=next_token)
+    while not self.limit_reached('vm'):
+      instances = self.retry_call(self.client.describe_instances, MaxResults=100, NextToken=next_token)
 
       for reservations in instances['Reservations']:
         for instance in reservations['Instances']:
-          data.append(self._process_vm(instance))
+          yield self._process_vm(instance)
 
       next_token = None
       if 'NextToken' in instances:
         next_token = instances['NextToken']
       if not next_token:
         break
-    return data
 
   def _get_instance_type(self, itype):
     if itype not in self.instance_types:
-      types = self.client.describe_instance_types(InstanceTypes = [ itype ])
-      for rec in types['InstanceTypes']:
-        name = rec['InstanceType']
-        data = {
-          "cpu": rec['VCpuInfo']['DefaultVCpus'],
-          "memory": rec['MemoryInfo']['SizeInMiB']
-        }
-        data['details'] = rec
-        self.instance_types[name] = data
+      data = self.reference_cache.get('aws', self.region, 'instance_types', itype, self.__load_instance_type)
+      if data is not None:
+        self.instance_types[itype] = data
 
     if itype not in self.instance_types:
       raise Exception("Instance type '{}' not found".format(itype))
 
     return self.instance_types[itype]
 
+  def __load_instance_type(self, itype):
+    types = self.retry_call(self.client.describe_instance_types, InstanceTypes = [ itype ])
+    for rec in types['InstanceTypes']:
+      if rec['InstanceType'] == itype:
+        return {
+          "cpu": rec['VCpuInfo']['DefaultVCpus'],
+          "memory": rec['MemoryInfo']['SizeInMiB'],
+          "details": rec
+        }
+    return None
+
   def _get_tags(self, data, tag_key="Tags"):
     tags = {}
     for tag in data.get(tag_key , []):
@@ -126,26 +145,11 @@ class CloudCollectorAmazonAWS(CloudInvetarioAmazonAWSResource):
           "connected": True
         })
 
-    # TODO: avoid duplicate counting
-    storage = 0
-    storages = []
-    ebs_data = self.get_resource_data("ebs") if 'ebs' in self.resource_collectors else None
-    if ebs_data and rec["InstanceId"] in ebs_data:
-      storage = ebs_data[rec["InstanceId"]]["size"]
-      storages = ebs_data[rec["InstanceId"]]["storages"]
-
     name = tags.get("Name") or rec["InstanceId"]
     logging.debug("new VM name={}".format(name))
 
-    ebs = self.resource_collectors["ebs"].get_raw_data() if 'ebs' in  self.resource_collectors else []
-
-    storage = 0
-    storages = []
-    for volume in ebs:
-      # XXX: only count storage size on one instance
-      if volume["mounts"] and rec["InstanceId"] == volume["mounts"][0]:
-        storage += volume["storage"]
-        storages.append(volume)
+    storages = self.get_resource_index("ebs", "instance").get(rec["InstanceId"], [])
+    storage = sum(volume["storage"] for volume in storages)
 
     vm_data = {
         "created": None,
@@ -156,7 +160,7 @@ class CloudCollectorAmazonAWS(CloudInvetarioAmazonAWSResource):
         "type": instance_type,
         "cpus": rec["CpuOptions"]["CoreCount"] or instance_def["cpu"],
         "memory": instance_def["memory"],
-        "disks": len(ebs),
+        "disks": len(storages),
         "storage": storage,
         "primary_ip":  rec.get("PrivateIpAddress") or rec.get("PublicIpAddress"),
         "primary_fqdn": rec.get("PrivateDnsName") or rec.get("PublicDnsName"),
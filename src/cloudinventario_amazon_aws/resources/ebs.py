@@ -12,6 +12,10 @@ class CloudInventarioEbs(CloudInvetarioResource):
   def __init__(self, resource, collector):
     super().__init__(resource, collector)
 
+  def _get_indexes(self):
+    # XXX: volume is only counted on first instance
+    return {"instance": lambda volume: volume["mounts"][0] if volume["mounts"] else None}
+
   def _login(self, session):
     self.session = session
     self.client = self.get_client()
@@ -23,9 +27,11 @@ class CloudInventarioEbs(CloudInvetarioResource):
   def _fetch(self):
     data = []
     pagiantor = self.client.get_paginator('describe_volumes')
-    response_iterator = pagiantor.paginate()
+    response_iterator = self.paginate(pagiantor)
 
     for page in response_iterator:
+      if self.limit_reached():
+        break
       for volume in page['Volumes']:
         data.append(self.process_resource(volume))
     return data
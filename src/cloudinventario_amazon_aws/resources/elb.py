@@ -27,15 +27,17 @@ class CloudInventarioElb(CloudInvetarioResource):
     def _fetch(self):
         data = []
         paginator = self.client.get_paginator('describe_load_balancers')
-        response_iterator = paginator.paginate()
+        response_iterator = self.paginate(paginator)
 
         for page in response_iterator:
+            if self.limit_reached():
+                break
             for lb in page['LoadBalancerDescriptions']:
                 data.append(self.process_resource(lb))
         return data
 
     def _process_resource(self, balancer):
-        health_info = self.client.describe_instance_health(
+        health_info = self.retry_call(self.client.describe_instance_health,
             LoadBalancerName=balancer['LoadBalancerName'])
         health_states = {}
         status = "unknown"
@@ -53,7 +55,7 @@ class CloudInventarioElb(CloudInvetarioResource):
                 "state": instance['State']
             }
 
-        tags_data = self.client.describe_tags(LoadBalancerNames=[
+        tags_data = self.retry_call(self.client.describe_tags, LoadBalancerNames=[
             balancer.get('LoadBalancerName', "")
         ])
         balancer.update(tags_data)
@@ -25,9 +25,11 @@ class CloudInventarioRds(CloudInvetarioResource):
     data = []
 
     paginator = self.client.get_paginator('describe_db_instances')
-    response_iterator = paginator.paginate()
+    response_iterator = self.paginate(paginator)
 
     for page in response_iterator:
+      if self.limit_reached():
+        break
       for db_instance in page['DBInstances']:
         data.append(self.process_resource(db_instance))
     return data
@@ -26,6 +26,8 @@ class CloudInventarioS3(CloudInvetarioResource):
     data = []
     
     for bucket in self.client.list_buckets()['Buckets']:
+      if self.limit_reached():
+        break
       data.append(self._process_resource(bucket['Name']))
 
     return data
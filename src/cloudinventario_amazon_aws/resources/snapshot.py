@@ -28,6 +28,8 @@ class CloudInventarioSnapshot(CloudInvetarioResource):
     ])
 
     for snapshot in snapshots:
+      if self.limit_reached():
+        break
       data.append(self._process_resource(snapshot))
     logging.info("collected {} snapshosts".format(len(data)))
     return data
@@ -8,11 +8,15 @@ from botocore.exceptions import ClientError
 
 from cloudinventario.cloudinventario import CloudInventario
 from cloudinventario.helpers import CloudCollector
+from cloudinventario.checkpoint import CloudInventarioCheckpoint
 from cloudinventario_amazon_aws_resource.collector import CloudInvetarioAmazonAWSResource
 
 # TEST MODE
 TEST = 0
 
+# concurrent logins of accounts/regions
+LOGIN_TASKS = 8
+
 def setup(name, config, defaults, options):
   return CloudCollectorAmazonAWSMulti(name, config, defaults, options)
 
@@ -46,7 +50,7 @@ class CloudCollectorAmazonAWSMulti(CloudInvetarioAmazonAWSResource):
     logging.info("assuming AWS roles")
     #self._add_creds_regions(None, access_key, secret_key, None, regions)
     if roles:
-      client = boto3.client('sts', aws_access_key_id = access_key, aws_secret_access_key = secret_key)
+      client = self.instrument.hook_boto3(boto3.client('sts', aws_access_key_id = access_key, aws_secret_access_key = secret_key))
 
       for role in roles:
         try:
@@ -64,7 +68,14 @@ class CloudCollectorAmazonAWSMulti(CloudInvetarioAmazonAWSResource):
           logging.warning(f"Skipping User: {role['account']}")
           self.status_error.append({'source': self.__dict__['name'], 'status': "error", 'error': f"AccessDenied on User: {role['account']} to perform: {role['role']}"}) #  store_status(self, source, status, runtime=None, error=None):
 
-    # create clients
+    # finished accounts/regions of previous (failed) run are not collected again
+    self.checkpoint = None
+    self.resumed = []
+    if self.config.get('checkpoint'):
+      self.checkpoint = CloudInventarioCheckpoint(self.name, self.config['checkpoint'])
+      self.checkpoint.begin([self._unit(cred) for cred in self.creds])
+
+    # create clients (cheap, shared parts are reused), login concurrently
     self.clients = []
     for cred in self.creds:
       name = self.name
@@ -72,17 +83,30 @@ class CloudCollectorAmazonAWSMulti(CloudInvetarioAmazonAWSResource):
         name = "{}@{}".format(name, cred['name'])
         self.defaults['project'] = cred['name']
 
+      if self.checkpoint and self.checkpoint.is_done(self._unit(cred)):
+        self.resumed.append(self._unit(cred))
+        continue
+
       cred['collect'] = self.config['collect']
-      handle = self._loadCollectorModule(name, cred, self.defaults, self.options)
-      handle.login()
+      handle = self.share(self._loadCollectorModule(name, cred, self.defaults, self.options))
 
       self.clients.append({
         "account_id": cred['account_id'] or 0,
+        "unit": self._unit(cred),
         "handle": handle
       })
 
+    login_tasks = self.config.get('login-tasks', LOGIN_TASKS)
+    if len(self.clients) > 0:
+      with concurrent.futures.ThreadPoolExecutor(max_workers = min(login_tasks, len(self.clients))) as executor:
+        for _ in executor.map(lambda client: client['handle'].login(), self.clients):
+          pass
+
     return True
 
+  def _unit(self, cred):
+    return "{}/{}/{}".format(cred['account_id'], cred['region'], cred['name'])
+
   def _add_creds_regions(self, name, account_id, access_key, secret_key, session_token = None, regions = None):
     if regions:
        for region in regions:
@@ -105,6 +129,7 @@ class CloudCollectorAmazonAWSMulti(CloudInvetarioAmazonAWSResource):
       # XXXX: discover enable regions using EC2 (what if other services have different enabled ?)
       client = boto3.client('ec2', aws_access_key_id = access_key, aws_secret_access_key = secret_key,
                                aws_session_token = session_token, region_name = self.primary_region)
+      self.instrument.hook_boto3(client)
       try:
         region_list = client.describe_regions()
       except ClientError as e:
@@ -123,18 +148,48 @@ class CloudCollectorAmazonAWSMulti(CloudInvetarioAmazonAWSResource):
     return self.creds
 
   def _fetch(self, collect):
-    res = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers = self.options["tasks"] or 1) as executor:
-      futures = []
+    for unit in self.resumed:
+      yield from self.checkpoint.load(unit)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.options["tasks"] or 1)
+    failed = True
+    try:
+      futures = {}
       for client in self.clients:
-         futures.append(executor.submit(client['handle'].fetch, collect))
+         futures[executor.submit(client['handle'].fetch, collect)] = client
+      error = None
       for future in concurrent.futures.as_completed(futures):
+        # drop finished results as soon as they are consumed
+        client = futures.pop(future)
+        if future.cancelled():
+          continue
         try:
-          res.extend(future.result())
+          res = future.result()
         except Exception as e:
           logging.error("Exception while processing account={}".format(client['account_id']))
-          raise
-    return res
+          if not self.checkpoint:
+            raise
+          # units not started yet are skipped, running ones are still checkpointed for the next run
+          if error is None:
+            error = e
+            for pending in futures:
+              pending.cancel()
+          continue
+        if self.checkpoint:
+          self.checkpoint.save(client['unit'], res or [])
+        if error is None:
+          yield from res or []
+      if error is not None:
+        raise error
+      failed = False
+    finally:
+      # do not wait for hung accounts on failure (e.g. timeout)
+      executor.shutdown(wait = not failed, cancel_futures = True)
+
+  def _stored(self):
+    # all units collected and committed
+    if self.checkpoint:
+      self.checkpoint.clear()
 
   def _logout(self):
     self.clients = None
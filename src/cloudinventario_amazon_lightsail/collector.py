@@ -26,13 +26,14 @@ class CloudCollectorAmazonLightsail(CloudCollectorAmazonAWS):
       logging.getLogger(logger).setLevel(logging.WARNING)
 
     if self.account_id is None:
-      sts = boto3.client('sts', aws_access_key_id = access_key, aws_secret_access_key = secret_key)
+      sts = self.instrument.hook_boto3(boto3.client('sts', aws_access_key_id = access_key, aws_secret_access_key = secret_key))
       ident = sts.get_caller_identity()
       self.account_id = ident['Account']
 
     logging.info("logging in AWS account_id={}, region={}".format(self.account_id, region))
     self.session = boto3.Session(aws_access_key_id = access_key, aws_secret_access_key = secret_key,
                                   aws_session_token = session_token, region_name = region)
+    self.instrument.hook_boto3(self.session)
     self.client = self.session.client('lightsail')
 
     self.instance_types = {}
@@ -42,7 +43,7 @@ class CloudCollectorAmazonLightsail(CloudCollectorAmazonAWS):
   def _fetch(self, collect):
     data = []
     paginator = self.client.get_paginator('get_instances')
-    response_iterator = paginator.paginate()
+    response_iterator = self.retry.paginate(paginator)
 
     for page in response_iterator:
       for instance in page['instances']:
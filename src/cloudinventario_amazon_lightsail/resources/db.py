@@ -22,7 +22,7 @@ class CloudInventarioLightsailDB(CloudInvetarioResource):
   def _fetch(self):
     data = []
     paginator = self.client.get_paginator('get_relational_databases')
-    response_iterator = paginator.paginate()
+    response_iterator = self.paginate(paginator)
 
     for page in response_iterator:
       for db in page['relationalDatabases']:
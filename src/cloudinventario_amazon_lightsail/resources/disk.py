@@ -22,7 +22,7 @@ class CloudInventarioLightsailDisks(CloudInvetarioResource):
   def _fetch(self):
     data = []
     paginator = self.client.get_paginator('get_disks')
-    response_iterator = paginator.paginate()
+    response_iterator = self.paginate(paginator)
 
     for page in response_iterator:
       for disk in page['disks']:
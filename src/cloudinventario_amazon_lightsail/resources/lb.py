@@ -22,7 +22,7 @@ class CloudInventarioLightsailLB(CloudInvetarioResource):
   def _fetch(self):
     data = []
     paginator = self.client.get_paginator('get_load_balancers')
-    response_iterator = paginator.paginate()
+    response_iterator = self.paginate(paginator)
 
     for page in response_iterator:
       for lb in page['loadBalancers']:
@@ -51,8 +51,8 @@ class CloudCollectorAmazonUsageCost(CloudInvetarioAmazonAWSResource):
       logging.getLogger(logger).setLevel(logging.WARNING)
 
     if self.account_id is None:
-      sts=boto3.client('sts', aws_access_key_id = access_key,
-                       aws_secret_access_key = secret_key)
+      sts=self.instrument.hook_boto3(boto3.client('sts', aws_access_key_id = access_key,
+                       aws_secret_access_key = secret_key))
       ident=sts.get_caller_identity()
       self.account_id=ident['Account']
 
@@ -60,6 +60,7 @@ class CloudCollectorAmazonUsageCost(CloudInvetarioAmazonAWSResource):
         self.account_id, region))
     self.session=boto3.Session(aws_access_key_id = access_key, aws_secret_access_key = secret_key,
                                   aws_session_token = session_token, region_name = region)
+    self.instrument.hook_boto3(self.session)
     self.client=self.session.client('ce')
 
     self.instance_types={}
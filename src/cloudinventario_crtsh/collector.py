@@ -15,6 +15,7 @@ def setup(name, config, defaults, options):
 class CloudCollectorCRTsh(CloudCollector):
     def __init__(self, name, config, defaults, options):
         super().__init__(name, config, defaults, options)
+        self.session = None
 
     def _config_keys():
         return {
@@ -30,6 +31,9 @@ class CloudCollectorCRTsh(CloudCollector):
         self.wildcard = self.config["wildcard"] if 'wildcard' in self.config else False 
         self.deduplicate = self.config["deduplicate"] if 'deduplicate' in self.config else False
 
+        # API calls are recorded by session hook
+        self.session = self.instrument.hook_requests(requests.Session(), 'crtsh')
+
         logging.info("logging in CRT.sh={}".format(self.identity))
         return self.identity
 
@@ -44,7 +48,7 @@ class CloudCollectorCRTsh(CloudCollector):
             self.identity = "%.{}".format(self.identity)
 
         url = base_url.format(self.identity)
-        request = requests.get(url)
+        request = self.session.get(url)
         logging.info("Create request as {}".format(url))
 
         if request.ok:
@@ -77,3 +81,6 @@ class CloudCollectorCRTsh(CloudCollector):
 
     def _logout(self):
         self.identity = None
+        if self.session:
+            self.session.close()
+            self.session = None
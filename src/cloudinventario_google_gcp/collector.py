@@ -73,6 +73,8 @@ class CloudCollectorGoogleGCP(CloudCollector):
         instances = _instance.list(project=self.project_name, zone=self.zone).execute()
 
         for instance in instances['items']:
+            if self.limit_reached('vm'):
+                break
             if 'name' in instance:
                 # GET resources
                 resource = _instance.listReferrers(project=self.project_name, zone=self.zone, instance=instance['name']).execute()
@@ -80,9 +82,8 @@ class CloudCollectorGoogleGCP(CloudCollector):
 
                 # GET machine type
                 machine_type_name = re.sub(r".*/machineTypes/", '', instance['machineType'])
-                _machine_type = self.compute_engine.machineTypes()
-                machine_type = _machine_type.get(project=self.project_name, zone=self.zone, machineType=machine_type_name).execute()
-                _machine_type.close()
+                machine_type = self.reference_cache.get('gcp', "{}/{}".format(self.project_name, self.zone), 'machine_types',
+                                                        machine_type_name, self._load_machine_type)
                 instance['machineTypeInfo'] = machine_type # Append machine into instance 'machineTypeInfo'
 
                 # GET disks
@@ -99,6 +100,12 @@ class CloudCollectorGoogleGCP(CloudCollector):
         self.compute_engine.close()
         return data
 
+    def _load_machine_type(self, machine_type_name):
+        _machine_type = self.compute_engine.machineTypes()
+        machine_type = _machine_type.get(project=self.project_name, zone=self.zone, machineType=machine_type_name).execute()
+        _machine_type.close()
+        return machine_type
+
     def _process_vm(self, rec):
         networks = []
         public_ip = rec['networkInterfaces'][0]['accessConfigs'][0].get('natIP') 
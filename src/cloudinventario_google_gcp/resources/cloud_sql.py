@@ -33,9 +33,8 @@ class CloudInventarioCloudSQL(CloudInvetarioResource):
     _instances.close()
 
     # GET tiers (Lists all available machine types for Cloud SQL)
-    _tiers = _sqladmin.tiers()
-    tiers = _tiers.list(project=self.project_name).execute()
-    _tiers.close()
+    tiers = self.collector.reference_cache.get_all('gcp', self.project_name, 'sql_tiers',
+                                                   lambda: self._list_tiers(_sqladmin))
 
     for instance in instances.get('items', []):
       # find tier in instance
@@ -48,6 +47,12 @@ class CloudInventarioCloudSQL(CloudInvetarioResource):
     _sqladmin.close()
     return data
 
+  def _list_tiers(self, sqladmin):
+    _tiers = sqladmin.tiers()
+    tiers = _tiers.list(project=self.project_name).execute()
+    _tiers.close()
+    return tiers
+
   def _process_resource(self, instance):
     mb = float(1<<20) # Megabytes
     # mb = float(1<<17) # Megabits
@@ -12,6 +12,9 @@ from cloudinventario.helpers import CloudCollector
 # TEST MODE
 TEST = 0
 
+# default servers processed per second
+HCLOUD_RATE = 4
+
 def setup(name, config, defaults, options):
   return CloudCollectorHetznerHCloud(name, config, defaults, options)
 
@@ -32,8 +35,11 @@ class CloudCollectorHetznerHCloud(CloudCollector):
     res = []
     servers = self.client.servers.get_all()
     for server in servers:
+      if self.limit_reached('vm'):
+        break
+      # processing loads server details on demand
+      self.rate_limit('servers', HCLOUD_RATE)
       res.append(self._process_vm(server))
-      time.sleep(1/4)
     return res
 
   def _to_dict(self, obj, key = None, level = 0):
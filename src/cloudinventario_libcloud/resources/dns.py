@@ -1,11 +1,13 @@
-import json, logging, traceback, time, re
+import json, logging, traceback
 from pprint import pprint
 
-from libcloud.common.exceptions import BaseHTTPError
 from libcloud.dns.providers import get_driver as dns_get_driver
 
 from cloudinventario.helpers import CloudInvetarioResource
 
+# default zones listed per second
+DNS_RATE = 3
+
 def setup(resource, collector):
     return CloudInventarioDNS(resource, collector)
 
@@ -31,31 +33,16 @@ class CloudInventarioDNS(CloudInvetarioResource):
 
     def _fetch(self):
             data = []
-            dns_s = self.driver_dns.list_zones()
+            dns_s = self.retry_call(self.driver_dns.list_zones)
 
             for dns in dns_s:
-                # Process record
-                retry = 0
-                retry_max = 3
-                while retry < retry_max:
-                  retry = retry + 1
-                  try:
-                    records = self.driver_dns.list_records(dns)
-                    for record in records:
-                        data.append(self._process_record(record.__dict__))
-
-                    # Process domain/zone
-                    data.append(self._process_dns(dns.__dict__))
-                    break
-                  except BaseHTTPError as error:
-                    if re.search('Throttling|Rate', error.message, re.IGNORECASE):
-                      time.sleep(3)
-                      if retry < retry_max:
-                        pass
-                      raise
-
-                # Slow down as we make many requests
-                time.sleep(1/3)
+                # Process record (throttled calls pause all zone listings, then are retried)
+                records = self.rate_limited_call('dns', DNS_RATE, self.driver_dns.list_records, dns)
+                for record in records:
+                    data.append(self._process_record(record.__dict__))
+
+                # Process domain/zone
+                data.append(self._process_dns(dns.__dict__))
 
             logging.info("Collected {} dns".format(len(data)))
             return data
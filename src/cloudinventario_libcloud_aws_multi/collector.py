@@ -30,6 +30,7 @@ class CloudCollectorLibcloudAWSMulti(CloudCollectorAmazonAWSMulti):
     # driver config
 
     config = {**self.libcloud_config}
+    config['driver_params'] = {**self.libcloud_config['driver_params']}
     # map config
     defaults['owner'] = cred['account_id']	# TODO!
 
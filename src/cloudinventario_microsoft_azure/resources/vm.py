@@ -75,6 +75,8 @@ class CloudInventarioAzureVM(CloudInvetarioResource):
         resources = list(self.resource_client.resources.list())
 
         for vm in list_of_virtual_machines:
+            if self.limit_reached():
+                break
             data.append(
                 self.__process_vm(
                     vm,
@@ -179,14 +181,15 @@ class CloudInventarioAzureVM(CloudInvetarioResource):
         :param vm_dict: Dict - virtual machine data in dictionary form 
         :return: Dict - virtual machine info
         """
-        vm_sizes_in_location = list(
-            self.compute_client.virtual_machine_sizes.list(
-                vm_dict.get('location'))
+        location = vm_dict.get('location')
+        vm_sizes_in_location = self.collector.reference_cache.get_all(
+            'azure', location, 'vm_sizes',
+            lambda: [_vm_size.as_dict() for _vm_size in self.compute_client.virtual_machine_sizes.list(location)]
         )
         vm_info = [
-            _vm_size for _vm_size in vm_sizes_in_location if _vm_size.name == vm_dict.get('hardware_profile').get('vm_size')
+            _vm_size for _vm_size in vm_sizes_in_location if _vm_size.get('name') == vm_dict.get('hardware_profile').get('vm_size')
         ][0]
-        return vm_info.as_dict()
+        return vm_info
 
     def __get_disks(self, group_name: str = None, vm_dict: Dict = None) -> List[Dict]:
         """Get and return all disks included to (managed by) given virtual machine.
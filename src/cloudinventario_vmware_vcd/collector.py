@@ -56,6 +56,11 @@ class CloudCollectorVMWareVCD(CloudCollector):
     self.client.set_credentials(vcd.BasicLoginCredentials(user, org, passwd))
     # TODO: check logged in ?
 
+    # API calls (after login) are recorded by hook of requests session of client
+    session = getattr(self.client, '_session', None)
+    if session is not None and hasattr(session, 'hooks'):
+      self.instrument.hook_requests(session, 'vcd')
+
     org_res = self.client.get_org()
     self.org = vcdOrg(self.client, resource = org_res)
     logging.info("logged in")
@@ -236,12 +241,18 @@ class CloudCollectorVMWareVCD(CloudCollector):
     except Exception as error:
       raise error
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers = self.options["tasks"] or 1) as executor:
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.options["tasks"] or 1)
+    failed = True
+    try:
       futures = []
       for vm_def in vm_list:
          futures.append(executor.submit(self.__process_vmlist_vm, org_name, vdc_name, vapp_name, vdc, vapp, vm_def, resource_type))
       for future in concurrent.futures.as_completed(futures):
          res.append(future.result())
+      failed = False
+    finally:
+      # do not wait for hung requests on failure (e.g. timeout)
+      executor.shutdown(wait = not failed, cancel_futures = True)
     return res
 
   def __process_vm(self, org_name, vdc_name, vapp_name, vm_name, vdc, vapp, vm):
@@ -47,12 +47,11 @@ class CloudCollectorVMWareVSphere(CloudCollector):
       return False
     if not self.client:
       return False
+    self.instrument.hook_pyvmomi(self.client._stub)
     logging.info("logged in")
     return True
 
   def _fetch(self, collect):
-    res = []
-
     self.content = self.client.RetrieveContent()
 
     # collect networks (DistributedVirtualPortgroup)
@@ -122,7 +121,7 @@ class CloudCollectorVMWareVSphere(CloudCollector):
           if isinstance(cluster, vim.ComputeResource):
             recs = self.__process_cluster(cluster)
             if recs:
-              res.extend(recs)
+              yield from recs
             if TEST:
               break
           else:
@@ -136,17 +135,23 @@ class CloudCollectorVMWareVSphere(CloudCollector):
       if hasattr(child, 'vmFolder'):
         datacenter = child
         vmFolder = datacenter.vmFolder
-        with concurrent.futures.ThreadPoolExecutor(max_workers = self.options["tasks"] or 1) as executor:
-          futures = []
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.options["tasks"] or 1)
+        failed = True
+        try:
+          futures = set()
           for vm in vmFolder.childEntity:
-            futures.append(executor.submit(self.__process_vmchild, vm))
+            futures.add(executor.submit(self.__process_vmchild, vm))
 
           for future in concurrent.futures.as_completed(futures):
+            # drop finished results as soon as they are consumed
+            futures.discard(future)
             recs = future.result()
             if recs:
-              res.extend(recs)
-
-    return res
+              yield from recs
+          failed = False
+        finally:
+          # do not wait for hung reads on failure (e.g. timeout)
+          executor.shutdown(wait = not failed, cancel_futures = True)
 
   def __process_cluster(self, cluster):
     name = cluster.name
@@ -348,6 +353,9 @@ class CloudCollectorVMWareVSphere(CloudCollector):
     return res
 
   def __process_vm(self, vm, parent):
+    # skip property reads when limit is reached
+    if self.limit_reached('vm'):
+      return []
     name = vm.name
     logging.debug("new vm name={}".format(name))
     vs = vm.summary